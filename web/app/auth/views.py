@@ -10,6 +10,7 @@ from flask_login import login_user, logout_user, login_required, current_user
 
 from .. import db
 from ..models import User, AuditLog
+from ..schema_compat import ensure_tables
 from ..security import (
     client_identifier,
     current_login_rate_limiter,
@@ -20,10 +21,8 @@ bp = Blueprint("auth", __name__)
 
 
 def _ensure_audit_table() -> None:
-    try:
-        AuditLog.__table__.create(bind=db.engine, checkfirst=True)
-    except Exception:
-        db.session.rollback()
+    # Table créée au démarrage (schema_compat) : un seul contrôle par process
+    ensure_tables(AuditLog)
 
 
 def _log_login_attempt(
@@ -27,7 +27,8 @@ from ..models import (
     event_stock,
     Role,
 )
-from ..tree_query import build_event_tree
+from ..tree_query import build_event_tree_json
+from ..jsonutil import json_bytes_response
 
 bp_events = Blueprint("events_api", __name__, url_prefix="/events")
 bp_public = Blueprint("public_api", __name__, url_prefix="/public")
@@ -297,19 +298,20 @@ def _validate_root_selection(
     return result
 
 
-def _collect_subtree_node_ids(root: StockNode) -> List[int]:
-    """Retourne la liste des ids du sous-arbre (racine incluse)."""
-
-    ids: List[int] = []
-    stack: List[StockNode] = [root]
-    while stack:
-        current = stack.pop()
-        try:
-            ids.append(int(current.id))
-        except Exception:
-            continue
-        stack.extend(list(current.children))
-    return ids
+def _collect_subtree_node_ids(root_ids: List[int]) -> List[int]:
+    """Retourne les ids des sous-arbres (racines incluses), en une CTE récursive."""
+    if not root_ids:
+        return []
+    nodes = StockNode.__table__
+    down = (
+        select(nodes.c.id)
+        .where(nodes.c.id.in_(root_ids))
+        .cte("subtree_ids", recursive=True)
+    )
+    down = down.union_all(
+        select(nodes.c.id).select_from(nodes.join(down, nodes.c.parent_id == down.c.id))
+    )
+    return list(db.session.execute(select(down.c.id)).scalars())
 
 
 # -------------------------------------------------
@@ -649,8 +651,7 @@ def event_tree(event_id: int):
     if not _can_view():
         abort(403)
     ev = _event_or_404(event_id)
-    tree = build_event_tree(ev.id)
-    return jsonify(tree)
+    return json_bytes_response(build_event_tree_json(ev.id))
 
 
 @bp_events.put("/<int:event_id>/roots")
@@ -715,12 +716,7 @@ def update_event_roots(event_id: int):
     ]
 
     if to_remove:
-        subtree_ids: Set[int] = set()
-        for nid in to_remove:
-            node = db.session.get(StockNode, nid)
-            if not node:
-                continue
-            subtree_ids.update(_collect_subtree_node_ids(node))
+        subtree_ids: Set[int] = set(_collect_subtree_node_ids(to_remove))
 
         if subtree_ids:
             VerificationRecord.query.filter(
@@ -1134,8 +1130,7 @@ def delete_event(event_id: int):
 @bp_public.get("/event/<token>/tree")
 def public_event_tree(token: str):
     ev = _event_from_token_or_404(token)
-    tree = build_event_tree(ev.id)
-    return jsonify(tree)
+    return json_bytes_response(build_event_tree_json(ev.id))
 
 @bp_public.post("/event/<token>/verify")
 def public_verify(token: str):
@@ -1281,19 +1276,3 @@ def public_parent_reassort(token: str):
     )
 
     return jsonify({"ok": True, "reassort_note": comment_data.get("reassort_note")})
-def _serialize_template(tpl: EventTemplate) -> Dict[str, Any]:
-    return {
-        "id": tpl.id,
-        "name": tpl.name,
-        "kind": getattr(tpl.kind, "name", str(tpl.kind)).upper(),
-        "description": tpl.description,
-        "nodes": [
-            {
-                "id": node.node_id,
-                "quantity": node.quantity,
-            }
-            for node in sorted(tpl.nodes, key=lambda n: n.node_id)
-        ],
-    }
-
-
@@ -0,0 +1,45 @@
+# app/jsonutil.py — encodage JSON rapide pour les gros payloads (arbres, exports)
+from __future__ import annotations
+
+import json
+from datetime import date, datetime
+from typing import Any
+
+from flask import Response
+
+try:  # dépendance optionnelle : repli sur json (stdlib) si absente
+    import orjson  # type: ignore
+    HAS_ORJSON = True
+except Exception:  # pragma: no cover - fallback sans orjson
+    orjson = None  # type: ignore
+    HAS_ORJSON = False
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """Sérialise ``obj`` en JSON UTF-8 compact (orjson si disponible)."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    """Désérialise du JSON (str ou bytes), via orjson si disponible."""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_response(obj: Any, status: int = 200) -> Response:
+    """Équivalent de ``jsonify`` qui passe par :func:`dumps`."""
+    return Response(dumps(obj), status=status, mimetype="application/json")
+
+
+def json_bytes_response(payload: bytes, status: int = 200) -> Response:
+    """Réponse pour un JSON déjà encodé (ex. arbre mis en cache)."""
+    return Response(payload, status=status, mimetype="application/json")
@@ -5,7 +5,7 @@ from datetime import datetime, date
 from typing import Optional, List
 
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import CheckConstraint, UniqueConstraint, Index
+from sqlalchemy import CheckConstraint, UniqueConstraint, Index, text
 from sqlalchemy.dialects.postgresql import JSONB
 from flask_login import UserMixin
 
@@ -185,6 +185,8 @@ class StockItemExpiry(db.Model):
 
     __table_args__ = (
         CheckConstraint("(quantity IS NULL) OR (quantity >= 0)", name="ck_itemexpiry_qty_nonneg"),
+        # péremptions d'un item triées par date / date la plus proche (MIN)
+        Index("ix_item_expiry_node_date", "node_id", "expiry_date"),
     )
 
 # -------------------------------------------------------------------
@@ -275,7 +277,18 @@ class VerificationRecord(db.Model):
     node  = db.relationship("StockNode")
 
     __table_args__ = (
-        Index("ix_verif_event_node_time", "event_id", "node_id", "created_at"),
+        # remplace ix_verif_event_node_time (event_id, node_id, created_at) et
+        # ix_verif_event_node_time_desc : mêmes recherches par préfixe, un seul btree
+        # à maintenir par insertion.
+        # "dernière vérif par item" : clé complète du tri de _latest_verifs_map
+        # (node_id, created_at DESC, id DESC), ordre fourni par l'index sans tri
+        # (PostgreSQL) ; pas couvrant (comment, issue_code, quantités lus dans le
+        # heap), cf. schema_compat
+        Index(
+            "ix_verif_event_node_recent",
+            "event_id", "node_id", text("created_at DESC"), text("id DESC"),
+            postgresql_include=["status", "verifier_name"],
+        ),
         CheckConstraint("(observed_qty IS NULL) OR (observed_qty >= 0)", name="ck_verif_observed_nonneg"),
         CheckConstraint("(missing_qty  IS NULL) OR (missing_qty  >= 0)", name="ck_verif_missing_nonneg"),
     )
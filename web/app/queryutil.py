@@ -0,0 +1,36 @@
+# app/queryutil.py — petits outils SQL partagés (IN découpés, compteur de requêtes)
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import event
+
+# Taille des lots pour les IN (...) sur de longues listes d'ids : reste sous la
+# limite de paramètres SQLite et garde un plan indexé côté PostgreSQL.
+IN_CHUNK = 500
+
+
+def in_chunks(ids: List[int], size: int = IN_CHUNK) -> Iterator[List[int]]:
+    """Découpe ``ids`` en lots de ``size``. Exécuter le lot n avec
+    ``execution_options(in_chunk=n)`` pour que :func:`count_queries` ne compte
+    que le premier."""
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+@contextmanager
+def count_queries(bind) -> Iterator[List[int]]:
+    """Compte les requêtes émises sur ``bind`` (garde-fou N+1 en mode debug)."""
+    counter = [0]
+
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        # les lots suivants d'un IN découpé (in_chunks) ne sont pas des N+1
+        if context is None or not context.execution_options.get("in_chunk"):
+            counter[0] += 1
+
+    event.listen(bind, "before_cursor_execute", _on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", _on_execute)
@@ -1,10 +1,17 @@
 # app/reports/utils.py — utilitaires pour exporter les données d'un événement
 from __future__ import annotations
 import json
+import time
 from datetime import datetime
+from itertools import groupby
+from operator import attrgetter
 from typing import List, Dict, Any, Tuple, Optional, Iterable
 
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
 from .. import db
+from ..tree_query import event_stock_version_parts
 from ..models import (
     Event,
     EventStatus,
@@ -21,26 +28,80 @@ from ..models import (
 # Helpers: construction d'arbre et lecture de l'état "dernier connu"
 # -------------------------------------------------------------------
 
-def _node_json(n: StockNode) -> Dict[str, Any]:
-    return {
-        "id": n.id,
-        "name": n.name,
-        "type": n.type.name,   # "GROUP" | "ITEM"
-        "level": n.level,
-        "quantity": n.quantity if n.type == NodeType.ITEM else None,
-        "unique_item": bool(getattr(n, "unique_item", False)),
-        "unique_quantity": getattr(n, "unique_quantity", None) if getattr(n, "unique_item", False) else None,
-        "children": [],
-    }
+# Colonnes utiles à la construction de l'arbre : lues en Core (Row), sans hydratation ORM
+_TREE_NODE_COLUMNS = (
+    StockNode.id,
+    StockNode.parent_id,
+    StockNode.name,
+    StockNode.type,
+    StockNode.level,
+    StockNode.quantity,
+    StockNode.unique_item,
+    StockNode.unique_quantity,
+)
+
+def _event_subtree_nodes_stmt(event_id: int):
+    """
+    SELECT des nœuds appartenant aux sous-arbres des racines liées à l'événement :
+    O(sous-arbres) lignes au lieu de toute la table stock_nodes. Chaque nœud
+    porte le ``selected_quantity`` de sa ligne event_stock (NULL s'il n'est pas
+    sélectionné) : _validate_root_selection n'impose pas parent_id NULL, une
+    sélection peut donc viser un descendant.
+    """
+    down = (
+        select(*_TREE_NODE_COLUMNS, event_stock.c.selected_quantity)
+        .join(event_stock, event_stock.c.node_id == StockNode.id)
+        .where(event_stock.c.event_id == event_id)
+        .where(StockNode.parent_id.is_(None))
+        .cte("event_subtree", recursive=True)
+    )
+    down = down.union_all(
+        select(*_TREE_NODE_COLUMNS, event_stock.c.selected_quantity)
+        .join(down, StockNode.parent_id == down.c.id)
+        .outerjoin(
+            event_stock,
+            (event_stock.c.node_id == StockNode.id) & (event_stock.c.event_id == event_id),
+        )
+    )
+    return select(down)
+
+# Noms des énums précalculés (Enum.name est une propriété, coûteuse en boucle)
+_NODE_TYPE_NAMES: Dict[NodeType, str] = {t: t.name for t in NodeType}
+
+def _event_leaves_stmt(event_id: int):
+    """
+    SELECT (id, type, unique_item) des "feuilles" de l'événement (ITEM ou parent
+    objet unique), telles que les construit _build_subtree : la descente s'arrête
+    aux feuilles. Sert aux récapitulatifs qui n'ont pas besoin de l'arbre complet.
+    """
+    cols = (StockNode.id, StockNode.type, StockNode.unique_item)
+    walk = (
+        select(*cols)
+        .join(event_stock, event_stock.c.node_id == StockNode.id)
+        .where(event_stock.c.event_id == event_id)
+        .where(StockNode.parent_id.is_(None))
+        .cte("event_walk", recursive=True)
+    )
+    walk = walk.union_all(
+        select(*cols)
+        .join(walk, StockNode.parent_id == walk.c.id)
+        .where(walk.c.type == NodeType.GROUP)
+        .where(walk.c.unique_item.is_(False))
+    )
+    return select(walk.c.id, walk.c.type, walk.c.unique_item).where(
+        (walk.c.type == NodeType.ITEM) | walk.c.unique_item.is_(True)
+    )
 
 def _children_index(all_nodes: List[StockNode]) -> Dict[Optional[int], List[StockNode]]:
-    idx: Dict[Optional[int], List[StockNode]] = {}
-    for n in all_nodes:
-        idx.setdefault(n.parent_id, []).append(n)
-    # tri stable par type puis nom (pour un rendu constant)
-    for k in idx:
-        idx[k].sort(key=lambda x: (x.type.name, x.name.lower()))
-    return idx
+    # un seul tri stable (parent, type, nom) puis découpage en tranches contiguës
+    # par parent : pas de tri par seau ; la clé est calculée une fois par nœud.
+    # Les racines (parent_id NULL) passent en tête.
+    names = _NODE_TYPE_NAMES
+    ordered = sorted(
+        all_nodes,
+        key=lambda x: (x.parent_id is not None, x.parent_id or 0, names[x.type], x.name.lower()),
+    )
+    return {pid: list(grp) for pid, grp in groupby(ordered, key=attrgetter("parent_id"))}
 
 def _decode_charge_comment(raw: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
     vehicle: Optional[str] = None
@@ -50,6 +111,9 @@ def _decode_charge_comment(raw: Optional[str]) -> Tuple[Optional[str], Optional[
         txt = raw.strip()
         if txt:
             try:
+                if txt[0] != "{":
+                    # texte libre "Véhicule: … | Par: …" : pas la peine de tenter le JSON
+                    raise ValueError("not a JSON object")
                 data = json.loads(txt)
             except Exception:
                 parts = [p.strip() for p in txt.split("|")]
@@ -83,23 +147,46 @@ def _decode_charge_comment(raw: Optional[str]) -> Tuple[Optional[str], Optional[
     return vehicle, operator, display
 
 
+# Nom normalisé de chaque statut, calculé une fois à l'import (évite isinstance/.upper() par ligne)
+_STATUS_NAMES: Dict[ItemStatus, str] = {s: s.name for s in ItemStatus}
+
+
 def _latest_verifications_map(event_id: int) -> Dict[int, Dict[str, Any]]:
     """
     Pour chaque ITEM (node_id) de l'événement, retourne uniquement
     la DERNIÈRE vérif (la plus récente).
     """
-    # On récupère tout et on déduplique en gardant la plus récente par node_id
-    rows: List[VerificationRecord] = (
-        VerificationRecord.query
-        .filter_by(event_id=event_id)
-        .order_by(VerificationRecord.node_id.asc(), VerificationRecord.created_at.desc())
-        .all()
+    cols = (
+        VerificationRecord.node_id,
+        VerificationRecord.status,
+        VerificationRecord.verifier_name,
+        VerificationRecord.comment,
+        VerificationRecord.created_at,
+        VerificationRecord.issue_code,
+        VerificationRecord.observed_qty,
+        VerificationRecord.missing_qty,
     )
+    newest_first = (VerificationRecord.created_at.desc(), VerificationRecord.id.desc())
+    # PostgreSQL : DISTINCT ON ; ailleurs ROW_NUMBER() = 1. Dans les deux cas
+    # seule la plus récente par node_id sort de la base.
+    if db.session.get_bind().dialect.name == "postgresql":
+        stmt = (
+            select(*cols)
+            .where(VerificationRecord.event_id == event_id)
+            .order_by(VerificationRecord.node_id.asc(), *newest_first)
+            .distinct(VerificationRecord.node_id)
+        )
+    else:
+        rn = func.row_number().over(partition_by=VerificationRecord.node_id, order_by=newest_first).label("rn")
+        ranked = select(*cols, rn).where(VerificationRecord.event_id == event_id).subquery()
+        stmt = select(ranked).where(ranked.c.rn == 1)
+
     latest: Dict[int, Dict[str, Any]] = {}
-    for r in rows:
+    # lecture par lots : pas de matérialisation de tout l'historique en mémoire
+    for r in db.session.execute(stmt.execution_options(yield_per=1000)):
         if r.node_id not in latest:
             latest[r.node_id] = {
-                "status": (r.status.name if isinstance(r.status, ItemStatus) else str(r.status)).upper(),
+                "status": _STATUS_NAMES.get(r.status) or str(r.status).upper(),
                 "verifier_name": r.verifier_name,
                 "comment": r.comment,
                 "created_at": r.created_at,
@@ -110,33 +197,32 @@ def _latest_verifications_map(event_id: int) -> Dict[int, Dict[str, Any]]:
             }
     return latest
 
-def _build_subtree(node: StockNode,
-                   idx: Dict[Optional[int], List[StockNode]],
-                   latest: Dict[int, Dict[str, Any]],
-                   selected_quantities: Dict[int, Optional[int]]) -> Tuple[Dict[str, Any], int, int]:
+_NO_VERIF: Dict[str, Any] = {}   # partagé en lecture seule pour les items jamais vérifiés
+
+def _leaf_subtree(node: StockNode,
+                  latest: Dict[int, Dict[str, Any]],
+                  selected_quantities: Dict[int, Optional[int]]) -> Tuple[Dict[str, Any], int]:
     """
-    Construit récursivement un sous-arbre JSON-safe.
-    Retourne (data, ok_count, total_items)
+    Nœud feuille (ITEM ou parent "objet unique") en un seul littéral.
+    Retourne (data, ok) ; une feuille compte toujours pour 1 item.
     """
-    data = _node_json(node)
-
-    # Feuille = ITEM
-    is_unique = bool(getattr(node, "unique_item", False))
-
-    if node.type == NodeType.ITEM or is_unique:
-        info = latest.get(node.id, {})
-        status = info.get("status", "TODO")
-        ok = 1 if status == "OK" else 0
-        total = 1
-        if is_unique:
-            qty_selected = selected_quantities.get(node.id)
-            if qty_selected is None:
-                qty_selected = getattr(node, "unique_quantity", None)
-            data["unique_item"] = True
-            data["unique_quantity"] = getattr(node, "unique_quantity", None)
-            data["quantity"] = qty_selected
-            data["selected_quantity"] = qty_selected
-        leaf_payload = {
+    is_unique = bool(node.unique_item)
+    type_name = _NODE_TYPE_NAMES[node.type]   # "GROUP" | "ITEM"
+    info = latest.get(node.id, _NO_VERIF)
+    status = info.get("status", "TODO")
+    ok = 1 if status == "OK" else 0
+
+    if not is_unique:
+        # cas courant : un seul dict, mêmes clés dans le même ordre pour tous les items
+        data = {
+            "id": node.id,
+            "name": node.name,
+            "type": type_name,
+            "level": node.level,
+            "quantity": node.quantity,
+            "unique_item": False,
+            "unique_quantity": None,
+            "children": [],
             "last_status": status,
             "last_by": info.get("verifier_name"),
             "last_at": info.get("created_at"),
@@ -145,89 +231,164 @@ def _build_subtree(node: StockNode,
             "observed_qty": info.get("observed_qty"),
             "missing_qty": info.get("missing_qty"),
         }
-        data.update(leaf_payload)
-
-        if node.type == NodeType.ITEM:
-            data.update(leaf_payload)
-            return data, ok, total
-
-        # unique parent behaving like a group -> attach synthetic child
-        data.update({
-            "unique_item": True,
-            "unique_parent": True,
-            "unique_quantity": getattr(node, "unique_quantity", None),
-            "quantity": qty_selected,
-            "selected_quantity": qty_selected,
-        })
+        return data, ok
+
+    leaf_payload = {
+        "last_status": status,
+        "last_by": info.get("verifier_name"),
+        "last_at": info.get("created_at"),
+        "comment": info.get("comment"),
+        "issue_code": info.get("issue_code"),
+        "observed_qty": info.get("observed_qty"),
+        "missing_qty": info.get("missing_qty"),
+    }
 
-        child = {
-            "id": f"unique-{node.id}",
-            "name": node.name,
-            "type": NodeType.ITEM.name,
-            "level": node.level + 1,
-            "quantity": qty_selected,
-            "unique_item": True,
-            "unique_from_parent": True,
-            "unique_parent_id": node.id,
-            "target_node_id": node.id,
-            **leaf_payload,
-        }
-        data["children"].append(child)
-        return data, ok, total
-
-    # Groupe = GROUP
-    children = idx.get(node.id, [])
-    data["unique_item"] = is_unique
-    if is_unique:
-        data["unique_quantity"] = getattr(node, "unique_quantity", None)
-    ok_sum = 0
-    total_sum = 0
-    for c in children:
-        cj, ok_c, tot_c = _build_subtree(c, idx, latest, selected_quantities)
-        data["children"].append(cj)
-        ok_sum += ok_c
-        total_sum += tot_c
-
-    # Un parent "complet" si tous ses items descendants sont OK
-    data.update({
-        "ok_count": ok_sum,
-        "total_items": total_sum,
-        "complete": (total_sum > 0 and ok_sum == total_sum),
+    unique_quantity = node.unique_quantity
+    qty_selected = selected_quantities.get(node.id)
+    if qty_selected is None:
+        qty_selected = unique_quantity
+    data = {
+        "id": node.id,
+        "name": node.name,
+        "type": type_name,
+        "level": node.level,
+        "quantity": qty_selected,
+        "unique_item": True,
+        "unique_quantity": unique_quantity,
+        "children": [],
+        "selected_quantity": qty_selected,
+        **leaf_payload,
+    }
+    if node.type is NodeType.ITEM:
+        return data, ok
+
+    # unique parent behaving like a group -> attach synthetic child
+    data["unique_parent"] = True
+    data["children"].append({
+        "id": f"unique-{node.id}",
+        "name": node.name,
+        "type": NodeType.ITEM.name,
+        "level": node.level + 1,
+        "quantity": qty_selected,
+        "unique_item": True,
+        "unique_from_parent": True,
+        "unique_parent_id": node.id,
+        "target_node_id": node.id,
+        **leaf_payload,
     })
-    return data, ok_sum, total_sum
+    return data, ok
+
+def _build_subtree(node: StockNode,
+                   idx: Dict[Optional[int], List[StockNode]],
+                   latest: Dict[int, Dict[str, Any]],
+                   selected_quantities: Dict[int, Optional[int]]) -> Tuple[Dict[str, Any], int, int]:
+    """
+    Construit un sous-arbre JSON-safe par un parcours post-ordre itératif
+    (pile explicite : pas de récursion Python, pas de RecursionError).
+    Retourne (data, ok_count, total_items)
+    """
+    done: Dict[int, Tuple[Dict[str, Any], int, int]] = {}
+    stack: List[Tuple[StockNode, bool]] = [(node, False)]
+    while stack:
+        n, expanded = stack.pop()
+        if n.type is NodeType.ITEM or n.unique_item:
+            data, ok = _leaf_subtree(n, latest, selected_quantities)
+            done[n.id] = (data, ok, 1)
+            continue
+
+        children = idx.get(n.id, [])
+        if not expanded:
+            # 1er passage : on revient sur le groupe après ses enfants
+            stack.append((n, True))
+            stack.extend((c, False) for c in reversed(children))
+            continue
+
+        # Groupe = GROUP (2e passage, enfants déjà construits)
+        built = [done.pop(c.id) for c in children]
+        children_json: List[Dict[str, Any]] = [cj for cj, _, _ in built]
+        ok_sum = sum(ok_c for _, ok_c, _ in built)
+        total_sum = sum(tot_c for _, _, tot_c in built)
+
+        # Un parent "complet" si tous ses items descendants sont OK
+        done[n.id] = ({
+            "id": n.id,
+            "name": n.name,
+            "type": _NODE_TYPE_NAMES[n.type],
+            "level": n.level,
+            "quantity": None,
+            "unique_item": False,
+            "unique_quantity": None,
+            "children": children_json,
+            "ok_count": ok_sum,
+            "total_items": total_sum,
+            "complete": (total_sum > 0 and ok_sum == total_sum),
+        }, ok_sum, total_sum)
+    return done[node.id]
+
+# Cache (process) des arbres d'événement, indexé par event_id et validé par une
+# "version" (vérifications + sélection de racines + nœuds / péremptions du stock,
+# cf. tree_query.event_stock_version_parts). Vidé à chaque commit de ce process,
+# écritures StockNode / StockItemExpiry comprises ; le TTL borne les modifications
+# en place faites ailleurs.
+_TREE_CACHE_TTL = 30.0
+_TREE_CACHE_MAX = 64
+_TREE_CACHE: Dict[int, Tuple[Tuple[Any, ...], float, List[Dict[str, Any]]]] = {}
+
+# Même principe pour la map "dernière vérif" : un export PDF/CSV la demande
+# jusqu'à trois fois (récap, arbre, lignes CSV) pour la même version.
+_LATEST_CACHE: Dict[int, Tuple[Tuple[Any, ...], float, Dict[int, Dict[str, Any]]]] = {}
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_report_caches(session: Session) -> None:
+    _TREE_CACHE.clear()
+    _LATEST_CACHE.clear()
+
+def _event_tree_version(event_id: int) -> Tuple[Any, ...]:
+    # agrégats en sous-requêtes scalaires, un seul aller-retour ; nœuds /
+    # péremptions du stock de l'événement inclus (écritures d'un autre process)
+    of_verifs = VerificationRecord.event_id == event_id
+    of_selection = event_stock.c.event_id == event_id
+    return tuple(db.session.execute(select(
+        select(func.count(VerificationRecord.id)).where(of_verifs).scalar_subquery(),
+        select(func.max(VerificationRecord.id)).where(of_verifs).scalar_subquery(),
+        select(func.count(event_stock.c.node_id)).where(of_selection).scalar_subquery(),
+        select(func.sum(event_stock.c.selected_quantity)).where(of_selection).scalar_subquery(),
+        *event_stock_version_parts(event_id),
+    )).one())
 
 def build_event_tree(event_id: int) -> List[Dict[str, Any]]:
     """
     Arbre complet des racines de stock attachées à l'événement.
     Chaque nœud est JSON-safe et contient les infos nécessaires aux exports.
+    L'arbre renvoyé peut être partagé (cache) : ne pas le modifier.
     """
-    # Racines liées à l'événement
-    selection_rows = db.session.execute(
-        event_stock.select().where(event_stock.c.event_id == event_id)
-    ).fetchall()
-    selected_quantities: Dict[int, Optional[int]] = {int(r.node_id): r.selected_quantity for r in selection_rows}
-
-    roots: List[StockNode] = (
-        db.session.query(StockNode)
-        .join(event_stock, event_stock.c.node_id == StockNode.id)
-        .filter(event_stock.c.event_id == event_id)
-        .filter(StockNode.parent_id.is_(None))   # uniquement les racines
-        .order_by(StockNode.name.asc())
-        .all()
-    )
-    if not roots:
+    version = _event_tree_version(event_id)
+    now = time.monotonic()
+    hit = _TREE_CACHE.get(event_id)
+    if hit and hit[0] == version and now - hit[1] <= _TREE_CACHE_TTL:
+        return hit[2]
+
+    tree = _build_event_tree(event_id)
+    if len(_TREE_CACHE) >= _TREE_CACHE_MAX:
+        _TREE_CACHE.clear()
+    _TREE_CACHE[event_id] = (version, now, tree)
+    return tree
+
+def _build_event_tree(event_id: int) -> List[Dict[str, Any]]:
+    # Racines + sous-arbres en une seule requête (CTE récursive), en lignes Core :
+    # les racines sont les lignes d'amorce (parent_id NULL) du résultat.
+    all_nodes = db.session.execute(_event_subtree_nodes_stmt(event_id)).all()
+    if not all_nodes:
         return []
-
-    # Tous les nœuds (pour pouvoir remonter les enfants sans n+1)
-    all_nodes: List[StockNode] = db.session.query(StockNode).all()
     idx = _children_index(all_nodes)
-    latest = _latest_verifications_map(event_id)
+    roots = sorted(idx.pop(None, []), key=lambda r: r.name)
+    # toutes les sélections de l'événement, racines ou non (comme avant la CTE)
+    selected_quantities: Dict[int, Optional[int]] = {
+        int(n.id): n.selected_quantity for n in all_nodes if n.selected_quantity is not None
+    }
+    latest = _cached_latest_verifications(event_id)
 
-    out: List[Dict[str, Any]] = []
-    for r in roots:
-        tree, _, _ = _build_subtree(r, idx, latest, selected_quantities)
-        out.append(tree)
-    return out
+    return [_build_subtree(r, idx, latest, selected_quantities)[0] for r in roots]
 
 # -------------------------------------------------------------------
 # Flatten, stats et exports
@@ -239,39 +400,59 @@ def flatten_items(tree: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     items: List[Dict[str, Any]] = []
 
-    def rec(n: Dict[str, Any]):
+    # parcours itératif en pré-ordre (enfants empilés à l'envers) : même ordre
+    # que l'ancienne récursion
+    stack = list(reversed(tree))
+    while stack:
+        n = stack.pop()
         if n.get("type") == "ITEM" or n.get("unique_item"):
             items.append(n)
-        for c in n.get("children", []):
-            rec(c)
-
-    for r in tree:
-        rec(r)
+        stack.extend(reversed(n.get("children", [])))
     return items
 
 def latest_verifications(event_id: int) -> Dict[int, Dict[str, Any]]:
     """
     Exposé public : map node_id -> infos dernière vérif.
-    (Réutilisé par rows_for_csv)
+    (Réutilisé par rows_for_csv) Mise en cache : ne pas modifier.
     """
-    return _latest_verifications_map(event_id)
+    return _cached_latest_verifications(event_id)
+
+def _cached_latest_verifications(event_id: int) -> Dict[int, Dict[str, Any]]:
+    version = tuple(db.session.execute(
+        select(func.count(VerificationRecord.id), func.max(VerificationRecord.id))
+        .where(VerificationRecord.event_id == event_id)
+    ).one())
+    now = time.monotonic()
+    hit = _LATEST_CACHE.get(event_id)
+    if hit and hit[0] == version and now - hit[1] <= _TREE_CACHE_TTL:
+        return hit[2]
+
+    latest = _latest_verifications_map(event_id)
+    if len(_LATEST_CACHE) >= _TREE_CACHE_MAX:
+        _LATEST_CACHE.clear()
+    _LATEST_CACHE[event_id] = (version, now, latest)
+    return latest
 
 def parent_statuses(event_id: int) -> Dict[int, Dict[str, Any]]:
     """
     Retourne l'état par parent (EventNodeStatus) : chargé, commentaire, MAJ.
     """
-    rows = EventNodeStatus.query.filter_by(event_id=event_id).all()
+    # lignes Core : seules les colonnes lues + nom du nœud, en une requête
+    rows = db.session.execute(
+        select(
+            EventNodeStatus.node_id,
+            EventNodeStatus.charged_vehicle,
+            EventNodeStatus.comment,
+            EventNodeStatus.updated_at,
+            StockNode.name,
+        )
+        .outerjoin(StockNode, StockNode.id == EventNodeStatus.node_id)
+        .where(EventNodeStatus.event_id == event_id)
+    )
     out: Dict[int, Dict[str, Any]] = {}
     for r in rows:
         vehicle, operator, display = _decode_charge_comment(r.comment)
-        node = getattr(r, "node", None)
-        node_name = getattr(node, "name", None) or f"Parent #{r.node_id}"
-        charged_vehicle_name = getattr(r, "charged_vehicle_name", None)
-        if not vehicle and charged_vehicle_name:
-            vehicle = charged_vehicle_name
-        charged_operator_name = getattr(r, "charged_operator_name", None)
-        if not operator and charged_operator_name:
-            operator = charged_operator_name
+        node_name = r.name or f"Parent #{r.node_id}"
         out[r.node_id] = {
             "charged_vehicle": r.charged_vehicle,
             "vehicle_name": vehicle,
@@ -373,21 +554,22 @@ def compute_summary(event_id: int) -> Dict[str, Any]:
     """
     Calcule un récap global simple (nb total d’items, OK, NOT_OK, TODO).
     """
-    tree = build_event_tree(event_id)
-    items = flatten_items(tree)
+    # Pas besoin de construire l'arbre : la CTE donne directement les feuilles.
+    # Même comptage que flatten_items sur l'arbre : un parent "objet unique" de
+    # type GROUP compte deux fois (lui-même + son enfant ITEM synthétique,
+    # même statut).
     latest = latest_verifications(event_id)
-    total = len(items)
-
-    def status_of(n: Dict[str, Any]) -> str:
-        # priorise last_status déjà présent dans l'arbre
-        s = n.get("last_status")
-        if s:
-            return s
-        info = latest.get(n["id"], {})
-        return info.get("status", "TODO")
-
-    ok = sum(1 for it in items if status_of(it) == "OK")
-    not_ok = sum(1 for it in items if status_of(it) == "NOT_OK")
+    total = 0
+    ok = 0
+    not_ok = 0
+    for nid, ntype, unique in db.session.execute(_event_leaves_stmt(event_id)):
+        weight = 2 if unique and ntype is not NodeType.ITEM else 1
+        total += weight
+        status = latest.get(nid, {}).get("status", "TODO")
+        if status == "OK":
+            ok += weight
+        elif status == "NOT_OK":
+            not_ok += weight
     todo = total - ok - not_ok
     return {"total": total, "ok": ok, "not_ok": not_ok, "todo": todo}
 
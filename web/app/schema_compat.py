@@ -45,11 +45,19 @@ def ensure_schema_compatibility() -> None:
         _ensure_event_template_tables(conn, tables)
         _ensure_event_material_slots_table(conn, tables)
         _ensure_reassort_tables(conn)
+        _ensure_expiry_table(conn)
         _ensure_periodic_verification_table(conn)
         _ensure_periodic_session_tables(conn)
         _ensure_audit_table(conn)
         _ensure_role_enum_value(conn)
 
+        if "verification_records" in tables:
+            _ensure_verification_index(conn)
+
+        # table créée plus haut (_ensure_expiry_table) si elle manquait
+        _ensure_expiry_index(conn)
+        _ensure_periodic_verification_index(conn)
+
 
 def _ensure_stock_nodes_columns(conn: Connection, inspector) -> None:
     columns = {col["name"] for col in inspector.get_columns("stock_nodes")}
@@ -148,6 +156,18 @@ def _ensure_reassort_tables(conn: Connection) -> None:
         current_app.logger.warning("Unable to ensure reassort tables: %s", exc)
 
 
+def _ensure_expiry_table(conn: Connection) -> None:
+    try:
+        from .models import StockItemExpiry  # import tardif
+    except Exception:
+        return
+
+    try:
+        StockItemExpiry.__table__.create(bind=conn, checkfirst=True)
+    except Exception as exc:  # pragma: no cover - garde-fou
+        current_app.logger.warning("Unable to ensure stock_item_expiries table: %s", exc)
+
+
 def _ensure_periodic_verification_table(conn: Connection) -> None:
     try:
         from .models import PeriodicVerificationRecord  # import tardif
@@ -269,6 +289,77 @@ def _ensure_role_enum_value(conn: Connection) -> None:
     except Exception as exc:  # pragma: no cover - garde-fou
         current_app.logger.warning("Unable to extend role enum: %s", exc)
 
+def _ensure_verification_index(conn: Connection) -> None:
+    """Index ordered for "latest record per item" (PostgreSQL).
+
+    Its key is the full sort of ``_latest_verifs_map`` (node_id, created_at DESC,
+    id DESC) under event_id, so DISTINCT ON needs no sort, not even an
+    incremental one on id. It is not covering: the latest-record query also
+    reads comment, issue_code, observed_qty and missing_qty from the heap.
+    It replaces ix_verif_event_node_time_desc (no id key column), which
+    ``CREATE INDEX IF NOT EXISTS`` could not alter in place, and the older
+    ascending ix_verif_event_node_time.
+    """
+    try:
+        if conn.dialect.name != "postgresql":
+            return
+    except Exception:  # pragma: no cover - defensive
+        return
+
+    try:
+        # SAVEPOINT : un échec ne doit pas annuler les étapes précédentes
+        with conn.begin_nested():
+            conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_verif_event_node_recent "
+                    "ON verification_records (event_id, node_id, created_at DESC, id DESC) "
+                    "INCLUDE (status, verifier_name)"
+                )
+            )
+            # les anciens index servent les mêmes recherches : un seul btree par insertion
+            conn.execute(text("DROP INDEX IF EXISTS ix_verif_event_node_time_desc"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_verif_event_node_time"))
+    except Exception as exc:  # pragma: no cover - garde-fou
+        current_app.logger.warning("Unable to ensure verification_records index: %s", exc)
+
+
+def _ensure_periodic_verification_index(conn: Connection) -> None:
+    """Index dans l'ordre de _latest_map (DISTINCT ON node_id, plus récent d'abord), PostgreSQL."""
+    try:
+        if conn.dialect.name != "postgresql":
+            return
+    except Exception:  # pragma: no cover - defensive
+        return
+
+    try:
+        # comment (TEXT, taille libre) reste hors de l'INCLUDE : lu dans le heap
+        with conn.begin_nested():
+            conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_pvr_node_recent "
+                    "ON periodic_verification_records (node_id, created_at DESC, id DESC) "
+                    "INCLUDE (status, issue_code, verifier_id, verifier_name, "
+                    "observed_qty, missing_qty, updated_at)"
+                )
+            )
+    except Exception as exc:  # pragma: no cover - garde-fou
+        current_app.logger.warning("Unable to ensure periodic_verification_records index: %s", exc)
+
+
+def _ensure_expiry_index(conn: Connection) -> None:
+    """Index (node_id, expiry_date) : péremptions d'un item déjà triées par date."""
+    try:
+        with conn.begin_nested():
+            conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_item_expiry_node_date "
+                    "ON stock_item_expiries (node_id, expiry_date)"
+                )
+            )
+    except Exception as exc:  # pragma: no cover - garde-fou
+        current_app.logger.warning("Unable to ensure stock_item_expiries index: %s", exc)
+
+
 def _execute_ignore_duplicate(conn: Connection, sql: str) -> None:
     try:
         conn.execute(text(sql))
@@ -278,3 +369,23 @@ def _execute_ignore_duplicate(conn: Connection, sql: str) -> None:
     except OperationalError as exc:  # pragma: no cover - SQLite path
         if "duplicate column" not in str(exc).lower():
             raise
+
+
+# Tables déjà vérifiées par ce process. Le DDL est fait au démarrage
+# (ensure_schema_compatibility) ; ce garde-fou ne refait le ``checkfirst``
+# qu'une fois par table si le démarrage a échoué, pas à chaque requête.
+_TABLES_READY: set[str] = set()
+
+
+def ensure_tables(*models) -> None:
+    """Crée les tables manquantes des modèles donnés, une seule fois par process."""
+    for model in models:
+        name = model.__tablename__
+        if name in _TABLES_READY:
+            continue
+        try:
+            model.__table__.create(bind=db.engine, checkfirst=True)
+        except Exception:
+            db.session.rollback()
+            continue
+        _TABLES_READY.add(name)
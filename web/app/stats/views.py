@@ -42,6 +42,8 @@ def event_tree(event_id: int):
     if not require_view():
         return jsonify(error="Forbidden"), 403
     tree = build_event_tree(event_id)
+    # jsonify conservé : last_at (datetime) sort au format HTTP-date attendu
+    # par les clients de cette API publique, pas en ISO 8601
     return jsonify(tree)
 
 @bp.get("/events/<int:event_id>/latest")
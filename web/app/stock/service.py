@@ -2,8 +2,8 @@
 from __future__ import annotations
 from typing import Optional, Dict, Any, List
 
-from sqlalchemy import case
-from sqlalchemy.orm import joinedload
+from sqlalchemy import case, select
+from sqlalchemy.orm import joinedload, selectinload
 
 from .. import db
 from ..models import (
@@ -168,6 +168,11 @@ def update_node(
     # Reparentage uniquement si changement effectif
     parent_changed = parent_id != node.parent_id
     if parent_changed:
+        # précharge le sous-arbre déplacé (les "children" non chargés sont remplis
+        # sur l'instance existante) : cycle, profondeur et niveaux sans lazy-load
+        db.session.scalars(
+            select(StockNode).where(StockNode.id == node.id).options(subtree_load_options())
+        ).all()
         parent = db.session.get(StockNode, parent_id) if parent_id else None
         if parent is not None:
             ensure_can_add_child(parent)
@@ -205,18 +210,19 @@ def delete_node(node_id: int):
     """
     Supprime le noeud et tout son sous-arbre (post-order).
     """
-    node = db.session.get(StockNode, node_id)
+    # sous-arbre préchargé (une requête par niveau) : collect/rec sans lazy-load
+    node = db.session.get(StockNode, node_id, options=[subtree_load_options()])
     if not node:
         raise LookupError("node not found")
 
+    # ids du sous-arbre : pile explicite (pas de récursion), append local
     node_ids: list[int] = []
-
-    def collect(n: StockNode):
-        node_ids.append(n.id)
-        for c in n.children:
-            collect(c)
-
-    collect(node)
+    append = node_ids.append
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        append(n.id)
+        stack.extend(n.children)
 
     if node_ids:
         db.session.query(PeriodicVerificationRecord).filter(
@@ -250,7 +256,7 @@ def duplicate_subtree(root_id: int, *, new_name: Optional[str] = None, new_paren
       - copie de quantity (ITEM) et expiry_date (ITEM)
       - rename de la racine si new_name fourni
     """
-    root = db.session.get(StockNode, root_id)
+    root = db.session.get(StockNode, root_id, options=[subtree_load_options()])
     if not root:
         raise LookupError("root not found")
 
@@ -301,6 +307,17 @@ def duplicate_subtree(root_id: int, *, new_name: Optional[str] = None, new_paren
     db.session.commit()
     return new_root
 
+def subtree_load_options():
+    """
+    Option de chargement : ``children`` en selectin sur toute la profondeur possible
+    (MAX_LEVEL niveaux, feuilles comprises) — une requête par niveau au lieu d'une
+    par nœud.
+    """
+    opt = selectinload(StockNode.children)
+    for _ in range(MAX_LEVEL - 1):
+        opt = opt.selectinload(StockNode.children)
+    return opt
+
 def serialize_tree(node: StockNode) -> Dict[str, Any]:
     """
     Sérialise un sous-arbre pour l’UI admin (manage.html).
@@ -324,6 +341,25 @@ def serialize_tree(node: StockNode) -> Dict[str, Any]:
         out["children"].append(serialize_tree(c))
     return out
 
+def resolve_root_id(node_id: int) -> Optional[int]:
+    """
+    Id de la racine du sous-arbre contenant 'node_id' (lui-même s'il est racine),
+    via une CTE récursive : une seule requête quelle que soit la profondeur.
+    """
+    nodes = StockNode.__table__
+    up = (
+        select(nodes.c.id, nodes.c.parent_id)
+        .where(nodes.c.id == node_id)
+        .cte("ancestors", recursive=True)
+    )
+    up = up.union_all(
+        select(nodes.c.id, nodes.c.parent_id)
+        .select_from(nodes.join(up, nodes.c.id == up.c.parent_id))
+    )
+    return db.session.execute(
+        select(up.c.id).where(up.c.parent_id.is_(None))
+    ).scalar()
+
 def list_roots() -> List[StockNode]:
     """
     Liste ordonnée de toutes les racines (parent_id=None).
@@ -342,3 +378,33 @@ def list_roots() -> List[StockNode]:
         )
     )
     return query.all()
+
+
+def list_root_rows() -> List[Any]:
+    """
+    Même liste que :func:`list_roots` mais en lignes Core (pas d'hydratation ORM),
+    pour les réponses JSON en lecture seule.
+    """
+    stmt = (
+        select(
+            StockNode.id,
+            StockNode.name,
+            StockNode.type,
+            StockNode.level,
+            StockNode.unique_item,
+            StockNode.unique_quantity,
+            StockRootCategory.id.label("category_id"),
+            StockRootCategory.name.label("category_name"),
+            StockRootCategory.position.label("category_position"),
+        )
+        .outerjoin(StockRootCategory, StockNode.root_category_id == StockRootCategory.id)
+        .where(StockNode.parent_id.is_(None))
+        .order_by(
+            case((StockRootCategory.id.is_(None), 1), else_=0),
+            StockRootCategory.position.asc(),
+            StockRootCategory.name.asc(),
+            StockNode.name.asc(),
+            StockNode.id.asc(),
+        )
+    )
+    return db.session.execute(stmt).all()
@@ -2,16 +2,18 @@
 from __future__ import annotations
 
 import json
+import time
 from datetime import date, datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from flask import Blueprint, request, jsonify, Response, render_template, abort
+from flask import Blueprint, request, jsonify, Response, render_template, abort, stream_with_context
 from flask_login import login_required, current_user
 
-from sqlalchemy import text, func
+from sqlalchemy import text, func, insert, select, update
 from sqlalchemy.exc import ProgrammingError, OperationalError
 
 from .. import db
+from ..jsonutil import dumps, json_response
 from ..models import Role, NodeType, StockNode, StockRootCategory
 from .service import (
     create_node,
@@ -20,8 +22,17 @@ from .service import (
     duplicate_subtree,
     serialize_tree,
     list_roots,
+    list_root_rows,
+    resolve_root_id,
+    subtree_load_options,
     _ROOT_CATEGORY_SENTINEL,
 )
+from .validators import (
+    ensure_level_valid,
+    ensure_item_quantity,
+    compute_new_level,
+    ensure_can_add_child,
+)
 
 # --- modèle optionnel (si présent dans app.models) ---
 try:
@@ -33,22 +44,22 @@ except Exception:
     HAS_EXP_MODEL = False
 
 
-def _serialize_root_node(root: StockNode) -> Dict[str, Any]:
-    category = getattr(root, "root_category", None)
+def _serialize_root_row(row: Any) -> Dict[str, Any]:
+    """Sérialise une ligne de :func:`list_root_rows` (racine + catégorie)."""
     return {
-        "id": root.id,
-        "name": root.name,
-        "type": root.type.name,
-        "level": root.level,
-        "unique_item": bool(getattr(root, "unique_item", False)),
-        "unique_quantity": getattr(root, "unique_quantity", None),
+        "id": row.id,
+        "name": row.name,
+        "type": row.type.name,
+        "level": row.level,
+        "unique_item": bool(row.unique_item),
+        "unique_quantity": row.unique_quantity,
         "root_category": (
             {
-                "id": category.id,
-                "name": category.name,
-                "position": category.position,
+                "id": row.category_id,
+                "name": row.category_name,
+                "position": row.category_position,
             }
-            if category
+            if row.category_id is not None
             else None
         ),
     }
@@ -76,6 +87,19 @@ def _reorder_root_category(category: StockRootCategory, new_position: int) -> No
         cat.position = idx
 
 
+def _expiry_summary(node_id: int) -> Dict[str, Any]:
+    """Nombre de lots et prochaine date d'un ITEM, en un seul agrégat SQL."""
+    count, next_date = (
+        db.session.query(
+            func.count(StockItemExpiry.id),  # type: ignore[union-attr]
+            func.min(StockItemExpiry.expiry_date),  # type: ignore[union-attr]
+        )
+        .filter(StockItemExpiry.node_id == node_id)  # type: ignore[union-attr]
+        .one()
+    )
+    return {"count": int(count or 0), "next": next_date}
+
+
 def _sync_item_legacy_expiry(item: Optional[StockNode]) -> Dict[str, Any]:
     """Synchronise la colonne héritée ``expiry_date`` avec les lots multiples.
 
@@ -86,21 +110,38 @@ def _sync_item_legacy_expiry(item: Optional[StockNode]) -> Dict[str, Any]:
     if not HAS_EXP_MODEL or not item or item.type != NodeType.ITEM:
         return {"count": 0, "next": None}
 
-    rows: List[StockItemExpiry] = (  # type: ignore[misc]
-        StockItemExpiry.query
-        .filter_by(node_id=item.id)
-        .order_by(StockItemExpiry.expiry_date.asc(), StockItemExpiry.id.asc())
-        .all()
-    )
-
-    next_date: Optional[date] = rows[0].expiry_date if rows else None
-    item.expiry_date = next_date
+    summary = _expiry_summary(item.id)
+    item.expiry_date = summary["next"]
     # Flush pour s'assurer que l'UI (tree JSON) voit la mise à jour.
     db.session.flush()
-    return {"count": len(rows), "next": next_date}
+    return summary
+
+
+def _sync_item_legacy_expiry_by_id(node_id: int) -> Dict[str, Any]:
+    """Variante par id : pas de chargement du StockNode, un UPDATE direct."""
+
+    if not HAS_EXP_MODEL:
+        return {"count": 0, "next": None}
+
+    summary = _expiry_summary(node_id)
+    db.session.execute(
+        update(StockNode)
+        .where(StockNode.id == node_id, StockNode.type == NodeType.ITEM)
+        .values(expiry_date=summary["next"])
+    )
+    return summary
 
 bp = Blueprint("stock", __name__)
 
+# Cache (process) du JSON de /stock/roots : vidé par chaque écriture de ce module,
+# le TTL borne l'obsolescence pour les écritures faites ailleurs (autre worker…).
+_ROOTS_CACHE_TTL = 30.0
+_ROOTS_CACHE: Dict[str, Any] = {"data": None, "at": 0.0}
+
+
+def _invalidate_roots_cache() -> None:
+    _ROOTS_CACHE["data"] = None
+
 
 # -------------------------------------------------
 # Droits
@@ -132,6 +173,27 @@ def _parse_iso_date(s: Optional[str]) -> Optional[date]:
     return date.fromisoformat(s)
 
 
+def _normalize_expiry(e: Optional[Dict[str, Any]], node_id: Optional[int]) -> Optional[Dict[str, Any]]:
+    """Normalise une péremption reçue du client en mapping prêt pour ``StockItemExpiry``.
+
+    Retourne None si la date est absente ; la quantité est ramenée à >= 0.
+    """
+    e = e or {}
+    ed = _parse_iso_date(e.get("expiry_date"))
+    if not ed:
+        return None
+    qty = e.get("quantity")
+    if qty is not None:
+        qty = max(int(qty), 0)
+    return {
+        "node_id": node_id,
+        "expiry_date": ed,
+        "quantity": qty,
+        "lot": e.get("lot") or None,
+        "note": e.get("note") or None,
+    }
+
+
 def _parse_bool(val: Any) -> Optional[bool]:
     if val is None:
         return None
@@ -151,15 +213,24 @@ def _parse_bool(val: Any) -> Optional[bool]:
 # -------------------------------------------------
 # Sécurité: créer la table des péremptions si manquante (lors 1er accès)
 # -------------------------------------------------
+# Résultat de la sonde mis en cache pour la durée du process : une fois la
+# table vue (ou créée), plus besoin de refaire le SELECT à chaque requête.
+_EXP_TABLE_OK: bool | None = None
+
+
 def _ensure_expiry_table() -> bool:
     """
     Évite les 500 "relation stock_item_expiries does not exist" si la migration n’a
     pas été jouée. On crée la table minimale côté Postgres si besoin.
     """
+    global _EXP_TABLE_OK
     if not HAS_EXP_MODEL:
         return False
+    if _EXP_TABLE_OK:
+        return True
     try:
         db.session.execute(text("SELECT 1 FROM stock_item_expiries LIMIT 1"))
+        _EXP_TABLE_OK = True
         return True
     except (ProgrammingError, OperationalError):
         # Table absente → on la crée
@@ -181,6 +252,7 @@ def _ensure_expiry_table() -> bool:
             if stmt.strip():
                 db.session.execute(text(stmt))
         db.session.commit()
+        _EXP_TABLE_OK = True
         return True
     except Exception:
         db.session.rollback()
@@ -266,6 +338,7 @@ def update_root_category_api(category_id: int):
 
     if changed:
         db.session.commit()
+        _invalidate_roots_cache()
 
     return jsonify(_serialize_root_category(category))
 
@@ -293,8 +366,13 @@ def delete_root_category_api(category_id: int):
 def get_roots():
     if not _can_read_stock():
         return _bad_request("Forbidden", 403)
-    roots = list_roots()
-    return jsonify([_serialize_root_node(r) for r in roots])
+    now = time.monotonic()
+    data = _ROOTS_CACHE["data"]
+    if data is None or now - _ROOTS_CACHE["at"] > _ROOTS_CACHE_TTL:
+        data = dumps([_serialize_root_row(r) for r in list_root_rows()])
+        _ROOTS_CACHE["data"] = data
+        _ROOTS_CACHE["at"] = now
+    return Response(data, mimetype="application/json")
 
 
 # -------------------------------------------------
@@ -310,15 +388,13 @@ def get_tree():
     except Exception:
         return _bad_request("root_id invalid")
 
-    node = db.session.get(StockNode, node_id)
+    # si l'id n'est pas une racine, on remonte jusqu'à la vraie racine (une requête)
+    root_id = resolve_root_id(node_id)
+    node = db.session.get(StockNode, root_id, options=[subtree_load_options()]) if root_id else None
     if not node:
         return _bad_request("Root not found", 404)
 
-    # si l'id n'est pas une racine, on remonte jusqu'à la vraie racine
-    while node.parent_id is not None:
-        node = node.parent
-
-    return jsonify(serialize_tree(node))
+    return json_response(serialize_tree(node))
 
 
 # -------------------------------------------------
@@ -386,7 +462,7 @@ def create_node_api():
             unique_quantity=unique_quantity if type_ == NodeType.GROUP else None,
             root_category_id=root_category_id if parent_id is None else None,
         )
-        node = db.session.get(StockNode, node.id)
+        _invalidate_roots_cache()
 
         needs_commit = False
         # rétro compat: single expiry_date (facultatif)
@@ -399,21 +475,9 @@ def create_node_api():
         expiries = data.get("expiries")
         if type_ == NodeType.ITEM and isinstance(expiries, list) and _ensure_expiry_table():
             for e in expiries:
-                ed = _parse_iso_date((e or {}).get("expiry_date"))
-                if not ed:
-                    continue
-                qty = e.get("quantity")
-                if qty is not None:
-                    qty = int(qty)
-                    if qty < 0:
-                        qty = 0
-                db.session.add(StockItemExpiry(  # type: ignore[misc]
-                    node_id=node.id,
-                    expiry_date=ed,
-                    quantity=qty,
-                    lot=(e.get("lot") or None),
-                    note=(e.get("note") or None),
-                ))
+                row = _normalize_expiry(e, node.id)
+                if row:
+                    db.session.add(StockItemExpiry(**row))  # type: ignore[misc]
             _sync_item_legacy_expiry(node)
             needs_commit = True
 
@@ -493,6 +557,7 @@ def update_node_api(node_id: int):
             unique_quantity=unique_quantity if node.type == NodeType.GROUP else None,
             root_category_id=root_category_param,
         )
+        _invalidate_roots_cache()
 
         needs_commit = False
 
@@ -503,31 +568,42 @@ def update_node_api(node_id: int):
 
         # NOUVEAU (optionnel): remplacement total des expiries via "expiries"
         if node.type == NodeType.ITEM and isinstance(data.get("expiries"), list) and _ensure_expiry_table():
-            # purge & recréation (simple et explicite)
-            db.session.execute(text("DELETE FROM stock_item_expiries WHERE node_id = :nid"), {"nid": node.id})
+            # diff sur la clé naturelle (date, lot) : on ne réécrit que ce qui change
+            existing_rows: List[StockItemExpiry] = (  # type: ignore[misc]
+                StockItemExpiry.query
+                .filter_by(node_id=node.id)
+                .order_by(StockItemExpiry.id.asc())
+                .all()
+            )
+            by_key: Dict[Any, List[StockItemExpiry]] = {}  # type: ignore[misc]
+            for row in existing_rows:
+                by_key.setdefault((row.expiry_date, row.lot), []).append(row)
+
             for e in data["expiries"]:
-                ed = _parse_iso_date((e or {}).get("expiry_date"))
-                if not ed:
+                wanted = _normalize_expiry(e, node.id)
+                if not wanted:
+                    continue
+                bucket = by_key.get((wanted["expiry_date"], wanted["lot"]))
+                if bucket:
+                    row = bucket.pop(0)
+                    if row.quantity != wanted["quantity"]:
+                        row.quantity = wanted["quantity"]
+                    if row.note != wanted["note"]:
+                        row.note = wanted["note"]
                     continue
-                qty = e.get("quantity")
-                if qty is not None:
-                    qty = int(qty)
-                    if qty < 0:
-                        qty = 0
-                db.session.add(StockItemExpiry(  # type: ignore[misc]
-                    node_id=node.id,
-                    expiry_date=ed,
-                    quantity=qty,
-                    lot=(e.get("lot") or None),
-                    note=(e.get("note") or None),
-                ))
+                db.session.add(StockItemExpiry(**wanted))  # type: ignore[misc]
+
+            stale_ids = [row.id for rows in by_key.values() for row in rows]
+            if stale_ids:
+                StockItemExpiry.query.filter(  # type: ignore[union-attr]
+                    StockItemExpiry.id.in_(stale_ids)  # type: ignore[union-attr]
+                ).delete(synchronize_session=False)
             _sync_item_legacy_expiry(node)
             needs_commit = True
 
         if needs_commit:
             db.session.commit()
 
-        node = db.session.get(StockNode, node_id)  # refresh
         return jsonify({
             "id": node.id, "name": node.name, "level": node.level, "type": node.type.name
         })
@@ -547,6 +623,7 @@ def delete_node_api(node_id: int):
         return _bad_request("Forbidden", 403)
     try:
         delete_node(node_id)
+        _invalidate_roots_cache()
         return jsonify({"ok": True})
     except LookupError:
         return _bad_request("Not found", 404)
@@ -570,6 +647,7 @@ def duplicate_node_api(node_id: int):
         return _bad_request("new_name required")
     try:
         new_root = duplicate_subtree(node_id, new_name=new_name, new_parent_id=new_parent_id)
+        _invalidate_roots_cache()
         return jsonify(
             {"id": new_root.id, "name": new_root.name, "level": new_root.level, "type": new_root.type.name}
         ), 201
@@ -585,12 +663,50 @@ def duplicate_node_api(node_id: int):
 @bp.get("/stock/export.json")
 @login_required
 def export_stock_json():
+    """
+    Export JSON du stock complet (racines, sous-arbres, catégories de racines).
+
+    La réponse est produite en flux, une racine à la fois, en JSON compact : elle
+    n'est plus indentée (``indent=2`` auparavant), les clés sont inchangées.
+    Toutes les lectures en base sont faites avant le début de la réponse : une
+    erreur SQL renvoie encore un vrai code d'erreur, jamais un JSON tronqué en 200.
+    """
     if not _can_read_stock():
         return _bad_request("Forbidden", 403)
 
     roots = list_roots()
+    # catégorie de chaque racine lue ici (joinedload dans list_roots), pas pendant le flux
+    root_categories: Dict[int, Optional[Dict[str, Any]]] = {
+        int(r.id): (
+            {"id": r.root_category.id, "name": r.root_category.name, "position": r.root_category.position}
+            if r.root_category
+            else None
+        )
+        for r in roots
+    }
 
-    def _serialize_tree_full(n: StockNode) -> Dict[str, Any]:
+    # Tous les descendants en une seule requête, indexés par parent (évite le N+1 sur n.children).
+    # Lignes Core lues par lots : tout le catalogue, sans instancier d'objets ORM.
+    children_idx: Dict[Optional[int], List[Any]] = {}
+    descendants = db.session.execute(
+        select(
+            StockNode.id,
+            StockNode.parent_id,
+            StockNode.name,
+            StockNode.type,
+            StockNode.level,
+            StockNode.quantity,
+            StockNode.unique_item,
+            StockNode.unique_quantity,
+            StockNode.expiry_date,
+        )
+        .where(StockNode.parent_id.isnot(None))
+        .execution_options(yield_per=1000)
+    )
+    for child in descendants:
+        children_idx.setdefault(child.parent_id, []).append(child)
+
+    def _serialize_tree_full(n: Any) -> Dict[str, Any]:
         out = {
             "id": n.id,
             "name": n.name,
@@ -604,17 +720,8 @@ def export_stock_json():
             "children": [],
         }
         if n.parent_id is None:
-            category = getattr(n, "root_category", None)
-            out["root_category"] = (
-                {
-                    "id": category.id,
-                    "name": category.name,
-                    "position": category.position,
-                }
-                if category
-                else None
-            )
-        children = sorted(n.children, key=lambda child: (child.type.name, child.name.lower() if child.name else "", child.id))
+            out["root_category"] = root_categories.get(int(n.id))
+        children = sorted(children_idx.get(n.id, []), key=lambda child: (child.type.name, child.name.lower() if child.name else "", child.id))
         for child in children:
             out["children"].append(_serialize_tree_full(child))
         # (Optionnel) tu peux ajouter ici "expiries": [...] si tu veux exporter les lots
@@ -625,21 +732,28 @@ def export_stock_json():
         .order_by(StockRootCategory.position.asc(), StockRootCategory.name.asc())
         .all()
     )
-    payload = {
-        "version": "1",
-        "generated_at": datetime.utcnow().isoformat() + "Z",
-        "roots": [_serialize_tree_full(r) for r in roots],
-        "root_categories": [
-            {
-                "id": cat.id,
-                "name": cat.name,
-                "position": cat.position,
-            }
-            for cat in categories
-        ],
-    }
+    categories_payload = [
+        {
+            "id": cat.id,
+            "name": cat.name,
+            "position": cat.position,
+        }
+        for cat in categories
+    ]
+    generated_at = datetime.utcnow().isoformat() + "Z"
+
+    # Sortie en flux : une racine sérialisée à la fois plutôt que tout l'arbre en
+    # mémoire ; le générateur ne lit plus que des données déjà chargées
+    def _generate():
+        yield b'{"version":"1","generated_at":' + dumps(generated_at) + b',"roots":['
+        for idx, root in enumerate(roots):
+            if idx:
+                yield b","
+            yield dumps(_serialize_tree_full(root))
+        yield b'],"root_categories":' + dumps(categories_payload) + b"}"
+
     return Response(
-        json.dumps(payload, ensure_ascii=False, indent=2),
+        stream_with_context(_generate()),
         mimetype="application/json; charset=utf-8",
         headers={"Content-Disposition": 'attachment; filename="stock_export.json"'},
     )
@@ -680,12 +794,16 @@ def import_stock():
         return _bad_request("mode must be 'merge' or 'replace'")
 
     try:
+        # À faire avant toute écriture : la création éventuelle de la table commit/rollback la session
+        has_exp_table = _ensure_expiry_table()
+
         if mode == "replace":
-            # suppression complète du stock
-            all_nodes = db.session.query(StockNode).all()
-            for n in reversed(all_nodes):
-                db.session.delete(n)
+            # suppression complète du stock : DELETE ensemblistes, sans charger les nœuds
+            if has_exp_table:
+                db.session.query(StockItemExpiry).delete(synchronize_session=False)  # type: ignore[arg-type]
+            db.session.query(StockNode).delete(synchronize_session=False)
             db.session.commit()
+            _invalidate_roots_cache()
 
             db.session.query(StockRootCategory).delete()
             db.session.commit()
@@ -742,7 +860,10 @@ def import_stock():
                     category.position = idx
             next_category_position = max(next_category_position, len(categories_payload))
 
-        def create_subtree(parent_id: Optional[int], node_dict: Dict[str, Any]) -> StockNode:
+        def build_node(
+            parent: Optional[StockNode], node_dict: Dict[str, Any]
+        ) -> Tuple[StockNode, List[Dict[str, Any]]]:
+            """Valide un nœud importé et prépare ses lignes de péremption."""
             name = (node_dict.get("name") or "").strip()
             if not name:
                 raise ValueError("node name required")
@@ -760,63 +881,73 @@ def import_stock():
                     unique_quantity_val = int(uq_raw) if uq_raw is not None else 0
                 except Exception:
                     unique_quantity_val = 0
+                if unique_quantity_val < 0:
+                    raise ValueError("unique_quantity must be an integer >= 0")
+
+            ensure_can_add_child(parent)
+            level = compute_new_level(parent)
+            ensure_level_valid(level)
+            ensure_item_quantity(type_, quantity)
 
             root_category_id: Optional[int] = None
-            if parent_id is None:
+            if parent is None:
                 root_spec: Any = node_dict.get("root_category")
                 if root_spec is None and node_dict.get("root_category_id") is not None:
                     root_spec = {"id": node_dict.get("root_category_id")}
                 root_category_id = resolve_category(root_spec)
 
-            node = create_node(
+            node = StockNode(
                 name=name,
-                type_=type_,
-                parent_id=parent_id,
+                type=type_,
+                level=level,
+                parent_id=parent.id if parent is not None else None,
                 quantity=quantity,
                 unique_item=unique_item if type_ == NodeType.GROUP else False,
                 unique_quantity=unique_quantity_val if (type_ == NodeType.GROUP and unique_item) else None,
-                root_category_id=root_category_id if parent_id is None else None,
+                root_category_id=root_category_id,
             )
 
-            needs_flush = False
             # rétro compat: single expiry_date
             if type_ == NodeType.ITEM and node_dict.get("expiry_date"):
                 node.expiry_date = _parse_iso_date(node_dict.get("expiry_date"))
-                needs_flush = True
 
-            # (optionnel) si l’import fournit "expiries"
+            # (optionnel) si l’import fournit "expiries" : node_id renseigné après le flush
+            expiry_rows: List[Dict[str, Any]] = []
             exps = node_dict.get("expiries")
-            if type_ == NodeType.ITEM and isinstance(exps, list) and _ensure_expiry_table():
+            if type_ == NodeType.ITEM and isinstance(exps, list) and has_exp_table:
                 for e in exps:
-                    ed = _parse_iso_date((e or {}).get("expiry_date"))
-                    if not ed:
-                        continue
-                    qty = e.get("quantity")
-                    if qty is not None:
-                        qty = int(qty)
-                        if qty < 0:
-                            qty = 0
-                    db.session.add(StockItemExpiry(  # type: ignore[misc]
-                        node_id=node.id,
-                        expiry_date=ed,
-                        quantity=qty,
-                        lot=(e.get("lot") or None),
-                        note=(e.get("note") or None),
-                    ))
-                _sync_item_legacy_expiry(node)
-                needs_flush = True
-
-            if needs_flush:
-                db.session.flush()
-
-            for c in node_dict.get("children") or []:
-                create_subtree(node.id, c)
-            return node
-
+                    row = _normalize_expiry(e, None)  # node_id connu après le flush
+                    if row:
+                        expiry_rows.append(row)
+                # équivalent de _sync_item_legacy_expiry : la date la plus proche
+                node.expiry_date = min((row["expiry_date"] for row in expiry_rows), default=None)
+            return node, expiry_rows
+
+        # Parcours en largeur : un flush (INSERT groupé) par niveau au lieu d'un
+        # commit par nœud ; les péremptions sont insérées en un seul lot à la fin.
         created_ids: List[int] = []
-        for r in roots:
-            new_root = create_subtree(None, r)
-            created_ids.append(new_root.id)
+        pending_expiries: List[Dict[str, Any]] = []
+        level_queue: List[Tuple[Optional[StockNode], Dict[str, Any]]] = [(None, r) for r in roots]
+        while level_queue:
+            level_nodes: List[Tuple[Dict[str, Any], StockNode, List[Dict[str, Any]]]] = []
+            for parent, node_dict in level_queue:
+                node, expiry_rows = build_node(parent, node_dict)
+                level_nodes.append((node_dict, node, expiry_rows))
+            db.session.add_all([node for _, node, _ in level_nodes])
+            db.session.flush()
+
+            level_queue = []
+            for node_dict, node, expiry_rows in level_nodes:
+                if node.parent_id is None:
+                    created_ids.append(node.id)
+                for row in expiry_rows:
+                    row["node_id"] = node.id
+                    pending_expiries.append(row)
+                for c in node_dict.get("children") or []:
+                    level_queue.append((node, c))
+
+        if pending_expiries:
+            db.session.execute(insert(StockItemExpiry), pending_expiries)  # type: ignore[arg-type]
 
         # Normalise les positions pour éviter les trous
         all_categories = (
@@ -828,6 +959,7 @@ def import_stock():
             cat.position = idx
 
         db.session.commit()
+        _invalidate_roots_cache()
 
         return jsonify({"ok": True, "created_roots": created_ids, "mode": mode})
     except Exception as e:
@@ -962,24 +1094,13 @@ def api_add_expiry(item_id: int):
         return _bad_request("expiry_date required (YYYY-MM-DD)")
 
     try:
-        ed = date.fromisoformat(date_raw)
+        _parse_iso_date(date_raw)
     except Exception:
         return _bad_request("invalid expiry_date (YYYY-MM-DD)")
 
     try:
-        qty = payload.get("quantity", None)
-        if qty is not None:
-            qty = int(qty)
-            if qty < 0:
-                qty = 0
-
-        rec = StockItemExpiry(  # type: ignore[misc]
-            node_id=item.id,
-            expiry_date=ed,
-            quantity=qty,
-            lot=(payload.get("lot") or None),
-            note=(payload.get("note") or None),
-        )
+        row = _normalize_expiry(dict(payload, expiry_date=date_raw), item.id)
+        rec = StockItemExpiry(**row)  # type: ignore[misc]
         db.session.add(rec)
         summary = _sync_item_legacy_expiry(item)
         db.session.commit()
@@ -1007,9 +1128,9 @@ def api_delete_expiry(exp_id: int):
         rec = db.session.get(StockItemExpiry, int(exp_id))  # type: ignore[misc]
         if not rec:
             return _bad_request("Not found", 404)
-        item = rec.item
+        node_id = rec.node_id
         db.session.delete(rec)
-        summary = _sync_item_legacy_expiry(item)
+        summary = _sync_item_legacy_expiry_by_id(node_id)
         db.session.commit()
         next_iso = summary["next"].isoformat() if summary.get("next") else None
         return jsonify({
@@ -1,22 +1,42 @@
 # app/tree_query.py — construction du TREE pour une page évènement
 from __future__ import annotations
-import json
+import re
+import time
+from collections import defaultdict
 from datetime import date
+from itertools import groupby
+from operator import attrgetter
 from typing import Dict, Any, List, Optional, Tuple
 
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
 from . import db
+from .jsonutil import dumps, loads
+from .queryutil import count_queries, in_chunks
 from .models import (
     Event,
     StockNode,
     NodeType,
     VerificationRecord,   # historise OK / NOT_OK / TODO
+    ItemStatus,
+    IssueCode,
     EventNodeStatus,      # infos “groupe chargé”, commentaires, etc.
     StockItemExpiry,      # ⬅️ nouvelles lignes d'expiration
     event_stock,          # table d’association (event_id, node_id)
 )
 
 # --------- helpers ---------
+# Valeurs connues (énums, None, booléens) normalisées d'avance : un dict.get par ligne
+_STATUS_NORM: Dict[Any, str] = {None: "TODO", True: "OK", False: "NOT_OK"}
+_STATUS_NORM.update({m: m.name for m in ItemStatus})
+_STATUS_NORM.update({m: m.name for m in IssueCode})
+
 def _norm_status(s: Optional[str]) -> str:
+    hit = _STATUS_NORM.get(s)
+    if hit is not None:
+        return hit
     if s is None:
         return "TODO"
     # Enum -> .name
@@ -36,133 +56,271 @@ def _latest_verifs_map(event_id: int, item_ids: List[int]) -> Dict[int, Dict[str
     """
     if not item_ids:
         return {}
-    q = (
-        VerificationRecord.query
-        .filter(VerificationRecord.event_id == event_id)
-        .filter(VerificationRecord.node_id.in_(item_ids))
-        .order_by(VerificationRecord.node_id.asc(), VerificationRecord.created_at.desc())
+    is_pg = db.session.get_bind().dialect.name == "postgresql"
+    # PostgreSQL : la date sort déjà au format ISO (pas d'isoformat() par ligne)
+    at_col = (
+        func.to_char(VerificationRecord.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+        if is_pg else VerificationRecord.created_at
+    ).label("at")
+    cols = (
+        VerificationRecord.node_id,
+        VerificationRecord.status,
+        VerificationRecord.verifier_name,
+        VerificationRecord.comment,
+        VerificationRecord.issue_code,
+        VerificationRecord.observed_qty,
+        VerificationRecord.missing_qty,
+        at_col,
     )
+    newest_first = (VerificationRecord.created_at.desc(), VerificationRecord.id.desc())
+
     out: Dict[int, Dict[str, Any]] = {}
-    for r in q:
-        nid = int(r.node_id)
-        if nid in out:
-            continue  # déjà le plus récent
-        out[nid] = {
-            "status": _norm_status(getattr(r, "status", None)),
-            "by": getattr(r, "verifier_name", None),
-            "at": (getattr(r, "updated_at", None) or getattr(r, "created_at", None)),
-            "comment": getattr(r, "comment", None),
-            "issue_code": _norm_status(getattr(r, "issue_code", None)),
-            "observed_qty": getattr(r, "observed_qty", None),
-            "missing_qty": getattr(r, "missing_qty", None),
-        }
-        if out[nid]["at"]:
-            out[nid]["at"] = out[nid]["at"].isoformat()
+    for n, chunk in enumerate(in_chunks(item_ids)):
+        scope = (
+            VerificationRecord.event_id == event_id,
+            VerificationRecord.node_id.in_(chunk),
+        )
+        # une seule ligne par node_id sort de la base, quel que soit l'historique
+        if is_pg:
+            stmt = (
+                select(*cols).where(*scope)
+                .order_by(VerificationRecord.node_id.asc(), *newest_first)
+                .distinct(VerificationRecord.node_id)
+            )
+        else:
+            rn = func.row_number().over(partition_by=VerificationRecord.node_id, order_by=newest_first).label("rn")
+            ranked = select(*cols, rn).where(*scope).subquery()
+            stmt = select(ranked).where(ranked.c.rn == 1).order_by(ranked.c.node_id)
+
+        rows = db.session.execute(stmt.execution_options(yield_per=1000, in_chunk=n))  # lecture par lots
+        # trié par node_id, une ligne par groupe (le premier reste le plus récent)
+        for nid, grp in groupby(rows, key=attrgetter("node_id")):
+            r = next(grp)
+            at = r.at
+            if at is not None and not isinstance(at, str):
+                at = at.isoformat()
+            out[int(nid)] = {
+                # table directe (cas courant), _norm_status seulement pour l'inattendu
+                "status": _STATUS_NORM.get(r.status) or _norm_status(r.status),
+                "by": r.verifier_name,
+                "at": at,
+                "comment": r.comment,
+                "issue_code": _STATUS_NORM.get(r.issue_code) or _norm_status(r.issue_code),
+                "observed_qty": r.observed_qty,
+                "missing_qty": r.missing_qty,
+            }
     return out
 
-def _ens_map(event_id: int) -> Dict[int, EventNodeStatus]:
-    rows = EventNodeStatus.query.filter_by(event_id=event_id).all()
-    return {int(r.node_id): r for r in rows}
+def _ens_map(event_id: int) -> Dict[int, Tuple[EventNodeStatus, Tuple[Optional[str], ...]]]:
+    """
+    {node_id: (ligne, méta décodée du commentaire)} : le commentaire est décodé
+    une seule fois ici, pas pendant la sérialisation.
+    """
+    # lignes Core : seules les colonnes lues par _serialize_node
+    rows = db.session.execute(
+        select(EventNodeStatus.node_id, EventNodeStatus.charged_vehicle, EventNodeStatus.comment)
+        .where(EventNodeStatus.event_id == event_id)
+    )
+    return {int(r.node_id): (r, _extract_charge_meta(r)) for r in rows}
 
 
+# Format texte historique : "Véhicule: … | Par: … | Réassort : …" (clé en préfixe,
+# valeur après le premier ":") ; une seule regex par segment
+_LEGACY_CHARGE_PART = re.compile(r"(véhicule|par|réassort)[^:]*:(.*)", re.IGNORECASE | re.DOTALL)
+
 def _extract_charge_meta(
     ens: EventNodeStatus,
 ) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
     """Decode vehicle / operator names stored in the comment JSON fallback."""
-    vehicle: Optional[str] = getattr(ens, "charged_vehicle_name", None)
+    vehicle: Optional[str] = None
     operator: Optional[str] = None
     reassort_note: Optional[str] = None
-    comment = getattr(ens, "comment", None)
+    comment = ens.comment
 
     display_comment: Optional[str] = None
     if comment:
         raw = comment.strip()
         if raw:
-            try:
-                data = json.loads(raw)
-            except Exception:
+            data = None
+            if raw[0] == "{":
+                # sinon texte libre "Véhicule: … | Par: …" : pas la peine de tenter le JSON
+                try:
+                    data = loads(raw)
+                except Exception:
+                    data = None
+            if not isinstance(data, dict):
                 display_comment = raw
-                parts = [p.strip() for p in raw.split("|")]
-                for part in parts:
-                    low = part.lower()
-                    if low.startswith("véhicule"):
-                        _, _, rest = part.partition(":")
-                        if rest.strip():
-                            vehicle = vehicle or rest.strip()
-                    elif low.startswith("par"):
-                        _, _, rest = part.partition(":")
-                        if rest.strip():
-                            operator = operator or rest.strip()
-                    elif low.startswith("réassort"):
-                        _, _, rest = part.partition(":")
-                        if rest.strip():
-                            reassort_note = reassort_note or rest.strip()
+                for part in raw.split("|"):
+                    m = _LEGACY_CHARGE_PART.match(part.strip())
+                    if not m:
+                        continue
+                    rest = m.group(2).strip()
+                    if not rest:
+                        continue
+                    key = m.group(1).lower()
+                    if key == "par":
+                        operator = operator or rest
+                    elif key == "réassort":
+                        reassort_note = reassort_note or rest
+                    else:
+                        vehicle = vehicle or rest
             else:
-                if isinstance(data, dict):
-                    veh_val = data.get("vehicle_name")
-                    op_val = data.get("operator_name")
-                    note_val = data.get("reassort_note")
-                    if veh_val:
-                        vehicle = veh_val.strip() or vehicle
-                    if op_val:
-                        operator = op_val.strip() or operator
-                    if note_val is not None:
-                        reassort_note = str(note_val).strip() or reassort_note
-                    parts: List[str] = []
-                    if vehicle:
-                        parts.append(f"Véhicule: {vehicle}")
-                    if operator:
-                        parts.append(f"Par: {operator}")
-                    if reassort_note:
-                        parts.append(f"Réassort : {reassort_note}")
-                    display_comment = " | ".join(parts) if parts else None
-                else:
-                    display_comment = raw
+                veh_val = data.get("vehicle_name")
+                op_val = data.get("operator_name")
+                note_val = data.get("reassort_note")
+                if veh_val:
+                    vehicle = veh_val.strip() or vehicle
+                if op_val:
+                    operator = op_val.strip() or operator
+                if note_val is not None:
+                    reassort_note = str(note_val).strip() or reassort_note
+                parts: List[str] = []
+                if vehicle:
+                    parts.append(f"Véhicule: {vehicle}")
+                if operator:
+                    parts.append(f"Par: {operator}")
+                if reassort_note:
+                    parts.append(f"Réassort : {reassort_note}")
+                display_comment = " | ".join(parts) if parts else None
 
     return vehicle, operator, display_comment, reassort_note
 
-def _expiries_for_items(item_ids: List[int]) -> Dict[int, List[StockItemExpiry]]:
-    """Batch: récupère toutes les lignes d'expiration pour les items donnés."""
+def _expiries_for_items(item_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Batch: récupère toutes les lignes d'expiration pour les items donnés,
+    directement sous forme de payload JSON (dates déjà formatées).
+    """
     if not item_ids:
         return {}
-    rows = (
-        StockItemExpiry.query
-        .filter(StockItemExpiry.node_id.in_(item_ids))
-        .order_by(StockItemExpiry.node_id.asc(), StockItemExpiry.expiry_date.asc(), StockItemExpiry.id.asc())
-        .all()
-    )
-    out: Dict[int, List[StockItemExpiry]] = {}
-    for e in rows:
-        out.setdefault(int(e.node_id), []).append(e)
+    iso = date.isoformat
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for n, chunk in enumerate(in_chunks(item_ids)):
+        rows = db.session.execute(
+            select(
+                StockItemExpiry.node_id,
+                StockItemExpiry.id,
+                StockItemExpiry.expiry_date,
+                StockItemExpiry.quantity,
+                StockItemExpiry.lot,
+                StockItemExpiry.note,
+            )
+            .where(StockItemExpiry.node_id.in_(chunk))
+            .order_by(StockItemExpiry.node_id.asc(), StockItemExpiry.expiry_date.asc(), StockItemExpiry.id.asc())
+            .execution_options(yield_per=1000, in_chunk=n)
+        )
+        # trié par node_id : lignes contiguës, un groupe par item
+        out.update(
+            (int(nid), [
+                {
+                    "date": iso(e.expiry_date),
+                    "quantity": e.quantity,
+                    "lot": e.lot,
+                    "note": e.note,
+                    "id": e.id,
+                }
+                for e in grp
+            ])
+            for nid, grp in groupby(rows, key=attrgetter("node_id"))
+        )
     return out
 
 # --------- arbre ---------
-def _serialize(node: StockNode,
-               latest: Dict[int, Dict[str, Any]],
-               is_root: bool,
-               ens_map: Dict[int, EventNodeStatus],
-               exp_map: Dict[int, List[StockItemExpiry]],
-               selected_quantities: Dict[int, Optional[int]]) -> Dict[str, Any]:
-    base: Dict[str, Any] = {
-        "id": node.id,
-        "name": node.name,
-        "type": node.type.name if hasattr(node.type, "name") else str(node.type),
-    }
-
-    if node.type == NodeType.ITEM:
-        info = latest.get(int(node.id), {})
-        # Nouvelles expirations multiples
-        exps = exp_map.get(int(node.id), [])
-        expiries_payload: List[Dict[str, Any]] = [
-            {
-                "date": e.expiry_date.isoformat(),
-                "quantity": e.quantity,
-                "lot": e.lot,
-                "note": e.note,
-                "id": e.id,
-            }
-            for e in exps
-        ]
+# Colonnes lues pour l'arbre : lignes Core (Row), sans attributs instrumentés ORM
+_NODE_COLUMNS = (
+    StockNode.id,
+    StockNode.parent_id,
+    StockNode.name,
+    StockNode.type,
+    StockNode.quantity,
+    StockNode.expiry_date,
+    StockNode.unique_item,
+    StockNode.unique_quantity,
+)
+
+def _is_leaf(n: Any) -> bool:
+    """ITEM ou parent "objet unique" : vérifié tel quel, on ne descend pas dessous."""
+    return n.type is NodeType.ITEM or bool(n.unique_item)
+
+def _subtree_index(roots: List[Any]) -> Tuple[Dict[int, List[Any]], List[int]]:
+    """
+    Charge en une requête (CTE récursive) les descendants des racines, sans
+    descendre sous les feuilles, et les indexe par parent_id.
+    Retourne (index des enfants, ids des feuilles à batcher : verifs + péremptions).
+    """
+    item_ids: List[int] = [int(r.id) for r in roots if _is_leaf(r)]
+    group_ids = [int(r.id) for r in roots if not _is_leaf(r)]
+    if not group_ids:
+        return {}, item_ids
+    down = (
+        select(*_NODE_COLUMNS)
+        .where(StockNode.parent_id.in_(group_ids))
+        .cte("subtree", recursive=True)
+    )
+    down = down.union_all(
+        select(*_NODE_COLUMNS)
+        .join(down, StockNode.parent_id == down.c.id)
+        .where(down.c.type == NodeType.GROUP)
+        .where(down.c.unique_item.is_(False))
+    )
+    idx: Dict[int, List[Any]] = defaultdict(list)
+    # Un groupe sélectionné peut être descendant d'une autre racine sélectionnée
+    # (_validate_root_selection ne le refuse pas) : son sous-arbre sort alors deux
+    # fois de l'UNION ALL. Une ligne par nœud suffit (les doublons sont identiques).
+    seen: set = set()
+    leaf_ids = set(item_ids)
+    for n in db.session.execute(select(down).order_by(down.c.id.asc())):
+        nid = int(n.id)
+        if nid in seen:
+            continue
+        seen.add(nid)
+        idx[int(n.parent_id)].append(n)
+        if _is_leaf(n) and nid not in leaf_ids:
+            leaf_ids.add(nid)
+            item_ids.append(nid)
+    return dict(idx), item_ids
+
+_NO_VERIF: Dict[str, Any] = {}   # défaut partagé (lecture seule) : item jamais vérifié
+
+# (clé de _latest_verifs_map, clé du payload) : omises du JSON quand None
+_VERIF_FIELDS = (
+    ("by", "last_by"),
+    ("at", "last_at"),
+    ("comment", "comment"),
+    ("issue_code", "issue_code"),
+    ("observed_qty", "observed_qty"),
+    ("missing_qty", "missing_qty"),
+)
+
+# Noms des types précalculés (Enum.name est une propriété, coûteuse en boucle)
+_TYPE_NAMES: Dict[Any, str] = {t: t.name for t in NodeType}
+
+def _add_verif_fields(data: Dict[str, Any], info: Dict[str, Any]) -> None:
+    """Ajoute en place les champs de vérif non vides (rien si jamais vérifié)."""
+    if not info:
+        return
+    for src, dst in _VERIF_FIELDS:
+        value = info.get(src)
+        if value is not None:
+            data[dst] = value
+
+def _serialize_node(node: StockNode,
+                    latest: Dict[int, Dict[str, Any]],
+                    is_root: bool,
+                    ens_map: Dict[int, Tuple[EventNodeStatus, Tuple[Optional[str], ...]]],
+                    exp_map: Dict[int, List[Dict[str, Any]]],
+                    selected_quantities: Dict[int, Optional[int]]
+                    ) -> Tuple[Dict[str, Any], Optional[List[Dict[str, Any]]]]:
+    """
+    Sérialise un nœud seul. Retourne (dict, liste "children" à remplir) ;
+    la liste vaut None quand on ne descend pas (ITEM, objet unique).
+    """
+    nid = int(node.id)
+    type_name = _TYPE_NAMES.get(node.type) or str(node.type)
+
+    if node.type is NodeType.ITEM:
+        info = latest.get(nid, _NO_VERIF)
+        # Nouvelles expirations multiples (payload préparé par _expiries_for_items)
+        expiries_payload: List[Dict[str, Any]] = exp_map.get(nid) or []
 
         # Par compatibilité avec l'ancien front : on garde expiry_date = la plus proche
         legacy_expiry = None
@@ -171,130 +329,220 @@ def _serialize(node: StockNode,
         elif node.expiry_date:
             legacy_expiry = node.expiry_date.isoformat()
 
-        base.update({
+        # un seul littéral pour les clés toujours présentes
+        item: Dict[str, Any] = {
+            "id": node.id,
+            "name": node.name,
+            "type": type_name,
             "last_status": info.get("status", "TODO"),
-            "last_by": info.get("by"),
-            "last_at": info.get("at"),
-            "comment": info.get("comment"),
-            "issue_code": info.get("issue_code"),
-            "observed_qty": info.get("observed_qty"),
-            "missing_qty": info.get("missing_qty"),
             "quantity": node.quantity,          # quantité cible (si définie)
-            "expiry_date": legacy_expiry,       # compatibilité
             "expiries": expiries_payload,       # ⬅️ liste complète des dates
-        })
-        base["children"] = []
-        return base
+            "children": [],
+        }
+        _add_verif_fields(item, info)           # champs vides omis (le front a ses défauts)
+        if legacy_expiry is not None:
+            item["expiry_date"] = legacy_expiry  # compatibilité
+        return item, None
 
     # GROUP
-    is_unique = bool(getattr(node, "unique_item", False))
+    base: Dict[str, Any] = {"id": node.id, "name": node.name, "type": type_name}
+    is_unique = bool(node.unique_item)
     children: List[Dict[str, Any]] = []
     if is_unique:
-        info = latest.get(int(node.id), {})
-        qty_selected = selected_quantities.get(int(node.id))
+        info = latest.get(nid, _NO_VERIF)
+        qty_selected = selected_quantities.get(nid)
         if qty_selected is None:
-            qty_selected = getattr(node, "unique_quantity", None)
+            qty_selected = node.unique_quantity
         base.update({
             "unique_item": True,
             "unique_parent": True,
-            "unique_quantity": getattr(node, "unique_quantity", None),
+            "unique_quantity": node.unique_quantity,
             "quantity": qty_selected,
             "selected_quantity": qty_selected,
             "last_status": info.get("status", "TODO"),
-            "last_by": info.get("by"),
-            "last_at": info.get("at"),
-            "comment": info.get("comment"),
-            "issue_code": info.get("issue_code"),
-            "observed_qty": info.get("observed_qty"),
-            "missing_qty": info.get("missing_qty"),
         })
-    else:
-        # relation ORM “children” ou requête fallback
-        if hasattr(node, "children"):
-            for c in node.children:
-                children.append(_serialize(c, latest, False, ens_map, exp_map, selected_quantities))
-        else:
-            childs = StockNode.query.filter_by(parent_id=node.id).all()
-            for c in childs:
-                children.append(_serialize(c, latest, False, ens_map, exp_map, selected_quantities))
+        _add_verif_fields(base, info)
 
     base["children"] = children
     base["is_event_root"] = bool(is_root)
 
-    ens = ens_map.get(int(node.id))
-    if ens:
-        base["charged_vehicle"] = getattr(ens, "charged_vehicle", None)
-        vehicle, operator, display_comment, reassort_note = _extract_charge_meta(ens)
+    entry = ens_map.get(nid)
+    if entry:
+        ens, (vehicle, operator, display_comment, reassort_note) = entry
+        base["charged_vehicle"] = ens.charged_vehicle
         base["charged_vehicle_name"] = vehicle
         if operator is not None:
             base["charged_operator_name"] = operator
         if display_comment:
             base["comment"] = display_comment
-        elif getattr(ens, "comment", None):
+        elif ens.comment:
             base["comment"] = ens.comment
         if reassort_note:
             base["reassort_note"] = reassort_note
 
     base["unique_item"] = is_unique
     if is_unique:
-        base["unique_quantity"] = getattr(node, "unique_quantity", None)
-    return base
+        base["unique_quantity"] = node.unique_quantity
+        return base, None
+    return base, children
 
-def build_event_tree(event_id: int) -> List[Dict[str, Any]]:
-    # Récupère les racines attachées à l’événement
-    rows = db.session.execute(
-        event_stock.select().where(event_stock.c.event_id == event_id)
-    ).fetchall()
-    root_ids = [r.node_id for r in rows]
-    selected_quantities: Dict[int, Optional[int]] = {int(r.node_id): r.selected_quantity for r in rows}
-    root_nodes: List[StockNode] = []
-    if root_ids:
-        root_nodes = StockNode.query.filter(StockNode.id.in_(root_ids)).all()
-
-    # Récupère tous les ITEM ids pour batcher verifs + expirations
-    item_ids: List[int] = []
-    def collect_items(n: StockNode):
-        if n.type == NodeType.ITEM or getattr(n, "unique_item", False):
-            item_ids.append(int(n.id))
+def _serialize(root: StockNode,
+               latest: Dict[int, Dict[str, Any]],
+               ens_map: Dict[int, Tuple[EventNodeStatus, Tuple[Optional[str], ...]]],
+               exp_map: Dict[int, List[Dict[str, Any]]],
+               selected_quantities: Dict[int, Optional[int]],
+               idx: Dict[int, List[StockNode]]) -> Dict[str, Any]:
+    """
+    Sérialise le sous-arbre d'une racine d'événement, en profondeur avec une
+    pile explicite (pas de récursion). Chaque nœud est ajouté à la liste
+    "children" de son parent au moment où il est dépilé : l'ordre est conservé.
+    """
+    out: Dict[str, Any] = {}
+    stack: List[Tuple[StockNode, Optional[List[Dict[str, Any]]]]] = [(root, None)]
+    while stack:
+        node, siblings = stack.pop()
+        data, children = _serialize_node(
+            node, latest, siblings is None, ens_map, exp_map, selected_quantities
+        )
+        if siblings is None:
+            out = data
         else:
-            if hasattr(n, "children") and n.children:
-                for c in n.children:
-                    collect_items(c)
-            else:
-                for c in StockNode.query.filter_by(parent_id=n.id).all():
-                    collect_items(c)
-    for r in root_nodes:
-        collect_items(r)
+            siblings.append(data)
+        if children is not None:
+            stack.extend((c, children) for c in reversed(idx.get(int(node.id), [])))
+    return out
+
+# Cache (process) des arbres d'événement. Vidé à chaque commit de ce process
+# (vérifs, statuts, mais aussi StockNode / StockItemExpiry : renommage,
+# quantité, péremption) ; la version (vérifs + statuts de groupes + nœuds et
+# péremptions du stock de l'événement) et le TTL couvrent les écritures faites
+# ailleurs (autre process, manage.py…).
+# Entrée : [version, horodatage, arbre, JSON encodé (rempli à la demande)].
+_TREE_CACHE_TTL = 30.0
+_TREE_CACHE_MAX = 64
+_TREE_CACHE: Dict[int, List[Any]] = {}
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_tree_cache(session: Session) -> None:
+    _TREE_CACHE.clear()
+
+def event_stock_version_parts(event_id: int) -> List[Any]:
+    """
+    Sous-requêtes scalaires (nombre, dernier id) des nœuds du stock de
+    l'événement et de leurs péremptions, à ajouter aux colonnes de la version
+    d'un cache d'arbre : un ajout / une suppression faits par un autre process
+    la change.
+    StockNode et StockItemExpiry n'ont pas d'updated_at : une modification en
+    place ailleurs reste bornée par le TTL.
+    """
+    walk = (
+        select(StockNode.id)
+        .join(event_stock, event_stock.c.node_id == StockNode.id)
+        .where(event_stock.c.event_id == event_id)
+        .cte("event_stock_walk", recursive=True)
+    )
+    walk = walk.union_all(select(StockNode.id).join(walk, StockNode.parent_id == walk.c.id))
+    in_walk = StockItemExpiry.node_id.in_(select(walk.c.id))
+    return [
+        select(func.count()).select_from(walk).scalar_subquery(),
+        select(func.max(walk.c.id)).scalar_subquery(),
+        select(func.count(StockItemExpiry.id)).where(in_walk).scalar_subquery(),
+        select(func.max(StockItemExpiry.id)).where(in_walk).scalar_subquery(),
+    ]
+
+def _tree_version(event_id: int) -> Tuple[Any, ...]:
+    # agrégats en sous-requêtes scalaires (pas de produit cartésien entre
+    # tables dérivées), un seul aller-retour
+    of_verifs = VerificationRecord.event_id == event_id
+    of_groups = EventNodeStatus.event_id == event_id
+    return tuple(db.session.execute(select(
+        select(func.count(VerificationRecord.id)).where(of_verifs).scalar_subquery(),
+        select(func.max(VerificationRecord.id)).where(of_verifs).scalar_subquery(),
+        select(func.count(EventNodeStatus.id)).where(of_groups).scalar_subquery(),
+        select(func.max(EventNodeStatus.updated_at)).where(of_groups).scalar_subquery(),
+        *event_stock_version_parts(event_id),
+    )).one())
+
+# Requêtes attendues pour une construction complète (racines, sous-arbre,
+# vérifs, ENS, expirations) : au-delà, un N+1 est réapparu.
+_TREE_QUERY_BUDGET = 5
+
+def build_event_tree(event_id: int) -> List[Dict[str, Any]]:
+    """
+    Arbre de l'événement (mémoïsé par événement + version).
+    L'arbre renvoyé peut être partagé : ne pas le modifier.
+    """
+    return _tree_entry(event_id)[2]
+
+def build_event_tree_json(event_id: int) -> bytes:
+    """
+    Même arbre, déjà encodé en JSON : l'encodage est fait une fois par version
+    et resservi tel quel aux requêtes suivantes.
+    """
+    entry = _tree_entry(event_id)
+    if entry[3] is None:
+        entry[3] = dumps(entry[2])
+    return entry[3]
+
+def _tree_entry(event_id: int) -> List[Any]:
+    version = _tree_version(event_id)
+    now = time.monotonic()
+    hit = _TREE_CACHE.get(event_id)
+    if hit and hit[0] == version and now - hit[1] <= _TREE_CACHE_TTL:
+        return hit
+
+    if current_app.debug:
+        # dev : compte les requêtes (approximatif si d'autres greenlets tournent)
+        with count_queries(db.session.get_bind()) as queries:
+            tree = _build_event_tree(event_id)
+        if queries[0] > _TREE_QUERY_BUDGET:
+            current_app.logger.warning(
+                "[TREE] event=%s : %s requêtes (budget %s), N+1 ?",
+                event_id, queries[0], _TREE_QUERY_BUDGET,
+            )
+    else:
+        tree = _build_event_tree(event_id)
+    if len(_TREE_CACHE) >= _TREE_CACHE_MAX:
+        _TREE_CACHE.clear()
+    entry = [version, now, tree, None]
+    _TREE_CACHE[event_id] = entry
+    return entry
+
+def _build_event_tree(event_id: int) -> List[Dict[str, Any]]:
+    # Racines attachées à l’événement + quantité sélectionnée, en une requête
+    root_nodes: List[Any] = db.session.execute(
+        select(*_NODE_COLUMNS, event_stock.c.selected_quantity)
+        .join(event_stock, event_stock.c.node_id == StockNode.id)
+        .where(event_stock.c.event_id == event_id)
+    ).all()
+    selected_quantities: Dict[int, Optional[int]] = {int(r.id): r.selected_quantity for r in root_nodes}
+
+    # Sous-arbres + ids des feuilles en une seule requête (plus de parcours récursif)
+    idx, item_ids = _subtree_index(root_nodes)
 
     latest = _latest_verifs_map(event_id, item_ids)
     ens_map = _ens_map(event_id)
     exp_map = _expiries_for_items(item_ids)
 
-    return [_serialize(r, latest, True, ens_map, exp_map, selected_quantities) for r in root_nodes]
+    return [_serialize(r, latest, ens_map, exp_map, selected_quantities, idx) for r in root_nodes]
 
 # --------- stats (optionnelles) ----------
 def tree_stats(tree: List[Dict[str, Any]]) -> Dict[str, int]:
     """Calcule un petit récapitulatif OK / NOT_OK / TODO."""
-    items: List[Dict[str, Any]] = []
-
-    def _is_unique_parent(n: Dict[str, Any]) -> bool:
-        return bool(n.get("unique_parent"))
+    total = ok = not_ok = 0
 
-    def collect(n: Dict[str, Any]):
+    # un seul parcours itératif (pile) qui compte au passage
+    stack = list(tree)
+    while stack:
+        n = stack.pop()
         if ((n.get("type") or "").upper() == "ITEM") or n.get("unique_item"):
-            items.append(n)
-        for c in n.get("children") or []:
-            collect(c)
-
-    for r in tree:
-        collect(r)
-
-    def status_of(n: Dict[str, Any]) -> str:
-        s = (n.get("last_status") or "TODO").upper()
-        return "OK" if s == "OK" else ("NOT_OK" if s == "NOT_OK" else "TODO")
+            total += 1
+            s = (n.get("last_status") or "TODO").upper()
+            if s == "OK":
+                ok += 1
+            elif s == "NOT_OK":
+                not_ok += 1
+        stack.extend(n.get("children") or ())
 
-    total = len(items)
-    ok = sum(1 for it in items if status_of(it) == "OK")
-    not_ok = sum(1 for it in items if status_of(it) == "NOT_OK")
     todo = total - ok - not_ok
     return {"total": total, "ok": ok, "not_ok": not_ok, "todo": todo}
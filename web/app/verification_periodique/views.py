@@ -2,13 +2,18 @@
 from __future__ import annotations
 
 from datetime import date, datetime
+from itertools import chain
 import secrets
-from typing import Any, Dict, List, Optional
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-from flask import Blueprint, jsonify, request, abort, render_template, url_for
+from flask import Blueprint, current_app, jsonify, request, abort, render_template, url_for
 from flask_login import current_user, login_required
 
 from .. import db
+from ..jsonutil import dumps, json_bytes_response, json_response
+from ..schema_compat import ensure_tables
+from ..queryutil import count_queries, in_chunks
 from ..models import (
     Role,
     StockNode,
@@ -20,9 +25,10 @@ from ..models import (
     IssueCode,
     ReassortItem,
     ReassortBatch,
+    User,
 )
-from ..tree_query import tree_stats
-from sqlalchemy import or_
+from sqlalchemy import case, event, func, insert, or_, select
+from sqlalchemy.orm import Session, contains_eager, raiseload
 
 try:  # Optional table depending on migrations
     from ..models import StockItemExpiry
@@ -52,51 +58,46 @@ def _can_manage_records() -> bool:
     )
 
 
+# Tables créées au démarrage (schema_compat) ; ces gardes ne refont le DDL
+# qu'une fois par process, plus à chaque requête.
 def _ensure_table() -> None:
-    try:
-        PeriodicVerificationRecord.__table__.create(bind=db.engine, checkfirst=True)
-    except Exception:
-        db.session.rollback()
+    ensure_tables(PeriodicVerificationRecord)
 
 
 def _ensure_reassort_tables() -> None:
-    try:
-        ReassortItem.__table__.create(bind=db.engine, checkfirst=True)
-        ReassortBatch.__table__.create(bind=db.engine, checkfirst=True)
-    except Exception:
-        db.session.rollback()
+    ensure_tables(ReassortItem, ReassortBatch)
 
 
 def _ensure_expiry_table() -> None:
-    if not HAS_EXP_MODEL:
-        return
-    try:
-        StockItemExpiry.__table__.create(bind=db.engine, checkfirst=True)  # type: ignore[union-attr]
-    except Exception:
-        db.session.rollback()
+    if HAS_EXP_MODEL:
+        ensure_tables(StockItemExpiry)
 
 
 def _ensure_session_table() -> None:
-    try:
-        PeriodicVerificationSession.__table__.create(bind=db.engine, checkfirst=True)
-    except Exception:
-        db.session.rollback()
+    ensure_tables(PeriodicVerificationSession)
 
 
 def _ensure_link_table() -> None:
-    try:
-        PeriodicVerificationLink.__table__.create(bind=db.engine, checkfirst=True)
-    except Exception:
-        db.session.rollback()
+    ensure_tables(PeriodicVerificationLink)
 
 
 def _resolve_root(node_id: int) -> Optional[StockNode]:
-    node = db.session.get(StockNode, node_id)
-    if not node:
-        return None
-    while node.parent_id is not None:
-        node = node.parent
-    return node
+    # Ancêtre sans parent en une requête (CTE récursive remontant parent_id),
+    # au lieu d'un lazy-load de node.parent par niveau
+    ancestors = (
+        select(StockNode.id, StockNode.parent_id)
+        .where(StockNode.id == node_id)
+        .cte("periodic_ancestors", recursive=True)
+    )
+    ancestors = ancestors.union_all(
+        select(StockNode.id, StockNode.parent_id)
+        .join(ancestors, StockNode.id == ancestors.c.parent_id)
+    )
+    return db.session.scalars(
+        select(StockNode)
+        .join(ancestors, StockNode.id == ancestors.c.id)
+        .where(ancestors.c.parent_id.is_(None))
+    ).first()
 
 
 def _sync_item_expiry(node_id: int) -> Optional[date]:
@@ -139,7 +140,16 @@ def _serialize_reassort_batch(batch: ReassortBatch, node_id: int) -> Dict[str, A
     }
 
 
+# Énums et None normalisés d'avance : un dict.get par ligne d'historique
+_STATUS_NORM: Dict[Any, str] = {None: "TODO"}
+_STATUS_NORM.update({m: m.name for m in ItemStatus})
+_STATUS_NORM.update({m: m.name for m in IssueCode})
+
+
 def _norm_status(value: Any) -> str:
+    hit = _STATUS_NORM.get(value)
+    if hit is not None:
+        return hit
     if value is None:
         return "TODO"
     if hasattr(value, "name"):
@@ -154,50 +164,79 @@ def _latest_map(node_ids: List[int]) -> Dict[int, Dict[str, Any]]:
     if not node_ids:
         return {}
 
-    rows = (
-        PeriodicVerificationRecord.query
-        .filter(PeriodicVerificationRecord.node_id.in_(node_ids))
-        .order_by(
-            PeriodicVerificationRecord.node_id.asc(),
-            PeriodicVerificationRecord.created_at.desc(),
-            PeriodicVerificationRecord.id.desc(),
-        )
-        .all()
+    # Seule la dernière vérif par nœud sort de la base, en un seul parcours :
+    # colonnes utiles + nom du vérificateur, sans hydratation ORM
+    pvr = PeriodicVerificationRecord
+    is_pg = db.session.get_bind().dialect.name == "postgresql"
+    # PostgreSQL : la date sort déjà au format ISO (pas d'isoformat() par ligne)
+    at_col = func.coalesce(pvr.updated_at, pvr.created_at)
+    if is_pg:
+        at_col = func.to_char(at_col, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+    cols = (
+        pvr.node_id,
+        pvr.status,
+        pvr.verifier_name,
+        User.username,
+        at_col.label("at"),
+        pvr.comment,
+        pvr.issue_code,
+        pvr.observed_qty,
+        pvr.missing_qty,
     )
+    newest_first = (pvr.created_at.desc(), pvr.id.desc())
+    base = select(*cols).outerjoin(User, User.id == pvr.verifier_id)
+
+    # IN (...) découpé par lots : nombre de paramètres borné, plan indexé par lot ;
+    # les lots sont disjoints, les résultats se fusionnent sans tri
+    rows: List[Any] = []
+    for n, chunk in enumerate(in_chunks(node_ids)):
+        chunk_q = base.where(pvr.node_id.in_(chunk))
+        if is_pg:
+            # DISTINCT ON : parcours de l'index (node_id, created_at), sans fenêtre
+            stmt = chunk_q.order_by(pvr.node_id.asc(), *newest_first).distinct(pvr.node_id)
+        else:
+            rn = func.row_number().over(partition_by=pvr.node_id, order_by=newest_first).label("rn")
+            ranked = chunk_q.add_columns(rn).subquery()
+            stmt = select(ranked).where(ranked.c.rn == 1)
+        rows.extend(db.session.execute(stmt.execution_options(in_chunk=n)))
 
     latest: Dict[int, Dict[str, Any]] = {}
     for row in rows:
-        nid = int(row.node_id)
-        if nid in latest:
-            continue
-        latest[nid] = {
-            "status": _norm_status(getattr(row, "status", None)),
-            "by": row.verifier_name or getattr(getattr(row, "verifier", None), "username", None),
-            "at": (getattr(row, "updated_at", None) or getattr(row, "created_at", None)),
-            "comment": getattr(row, "comment", None),
-            "issue_code": _norm_status(getattr(row, "issue_code", None)) if getattr(row, "issue_code", None) else None,
-            "observed_qty": getattr(row, "observed_qty", None),
-            "missing_qty": getattr(row, "missing_qty", None),
+        at = row.at
+        if at is not None and not isinstance(at, str):
+            at = at.isoformat()
+        latest[int(row.node_id)] = {
+            "status": _STATUS_NORM.get(row.status) or _norm_status(row.status),
+            "by": row.verifier_name or row.username,
+            "at": at,
+            "comment": row.comment,
+            "issue_code": (_STATUS_NORM.get(row.issue_code) or _norm_status(row.issue_code)) if row.issue_code else None,
+            "observed_qty": row.observed_qty,
+            "missing_qty": row.missing_qty,
         }
-        if latest[nid]["at"]:
-            latest[nid]["at"] = latest[nid]["at"].isoformat()
     return latest
 
 
 def _expiries_for_items(item_ids: List[int]) -> Dict[int, List[StockItemExpiry]]:  # type: ignore[name-defined]
     if not HAS_EXP_MODEL or not item_ids:
         return {}
+    # Même découpage que _latest_map : chaque lot est trié (node_id, date, id),
+    # et un node_id n'apparaît que dans un seul lot → ordre par article conservé
+    rows: List[StockItemExpiry] = []  # type: ignore[name-defined]
     try:
-        rows = (
-            StockItemExpiry.query  # type: ignore[union-attr]
-            .filter(StockItemExpiry.node_id.in_(item_ids))  # type: ignore[union-attr]
-            .order_by(
-                StockItemExpiry.node_id.asc(),  # type: ignore[union-attr]
-                StockItemExpiry.expiry_date.asc(),  # type: ignore[union-attr]
-                StockItemExpiry.id.asc(),  # type: ignore[union-attr]
+        for n, chunk in enumerate(in_chunks(item_ids)):
+            rows.extend(
+                StockItemExpiry.query  # type: ignore[union-attr]
+                .options(raiseload("*"))  # colonnes seules : tout lazy-load est un bug
+                .filter(StockItemExpiry.node_id.in_(chunk))  # type: ignore[union-attr]
+                .order_by(
+                    StockItemExpiry.node_id.asc(),  # type: ignore[union-attr]
+                    StockItemExpiry.expiry_date.asc(),  # type: ignore[union-attr]
+                    StockItemExpiry.id.asc(),  # type: ignore[union-attr]
+                )
+                .execution_options(in_chunk=n)
+                .all()
             )
-            .all()
-        )
     except Exception:
         db.session.rollback()
         return {}
@@ -208,7 +247,58 @@ def _expiries_for_items(item_ids: List[int]) -> Dict[int, List[StockItemExpiry]]
     return out
 
 
-def _serialize(node: StockNode, latest: Dict[int, Dict[str, Any]], exp_map: Dict[int, List[StockItemExpiry]]) -> Dict[str, Any]:  # type: ignore[name-defined]
+# Colonnes lues pour l'arbre : lignes Core (Row), sans objets ORM ni lazy-load
+_SUBTREE_COLUMNS = (
+    StockNode.id,
+    StockNode.parent_id,
+    StockNode.name,
+    StockNode.type,
+    StockNode.level,
+    StockNode.quantity,
+    StockNode.expiry_date,
+    StockNode.unique_item,
+    StockNode.unique_quantity,
+)
+
+
+def _subtree_cte(root_ids: List[int]):
+    """CTE récursive des sous-arbres des racines, sans descendre sous les feuilles."""
+    walk = (
+        select(*_SUBTREE_COLUMNS)
+        .where(StockNode.id.in_(root_ids))
+        .cte("periodic_subtree", recursive=True)
+    )
+    return walk.union_all(
+        select(*_SUBTREE_COLUMNS)
+        .join(walk, StockNode.parent_id == walk.c.id)
+        .where(walk.c.type == NodeType.GROUP)
+        .where(walk.c.unique_item.is_(False))
+    )
+
+
+def _load_subtrees(root_ids: List[int]) -> Tuple[Dict[int, Any], Dict[int, List[Any]], List[int]]:
+    """
+    Sous-arbres des racines en une requête (_subtree_cte). Retourne (racines par
+    id, enfants par parent_id triés par (level, id), ids des feuilles ITEM /
+    objet unique).
+    """
+    walk = _subtree_cte(root_ids)
+    root_set = set(root_ids)
+    roots: Dict[int, Any] = {}
+    children: Dict[int, List[Any]] = {}
+    item_ids: List[int] = []
+    for row in db.session.execute(select(walk).order_by(walk.c.level.asc(), walk.c.id.asc())):
+        if row.id in root_set:
+            roots[row.id] = row
+        else:
+            children.setdefault(row.parent_id, []).append(row)
+        if row.type is NodeType.ITEM or row.unique_item:
+            item_ids.append(int(row.id))
+    return roots, children, item_ids
+
+
+def _node_payload(node: Any, latest: Dict[int, Dict[str, Any]], exp_map: Dict[int, List[StockItemExpiry]]) -> Dict[str, Any]:  # type: ignore[name-defined]
+    """Payload d'un nœud seul ; les enfants des groupes sont rattachés par _build_trees."""
     base: Dict[str, Any] = {
         "id": node.id,
         "name": node.name,
@@ -252,9 +342,7 @@ def _serialize(node: StockNode, latest: Dict[int, Dict[str, Any]], exp_map: Dict
         )
         return base
 
-    is_unique = bool(getattr(node, "unique_item", False))
-    children: List[Dict[str, Any]] = []
-    if is_unique:
+    if getattr(node, "unique_item", False):
         info = latest.get(int(node.id), {})
         qty = getattr(node, "unique_quantity", None)
         base.update(
@@ -274,45 +362,168 @@ def _serialize(node: StockNode, latest: Dict[int, Dict[str, Any]], exp_map: Dict
                 "children": [],
             }
         )
-    else:
-        ordered_children = sorted(node.children, key=lambda c: (c.level, c.id)) if hasattr(node, "children") else []
-        for child in ordered_children:
-            children.append(_serialize(child, latest, exp_map))
-        base["children"] = children
-
-    base["unique_item"] = is_unique
-    if is_unique:
-        base.setdefault("unique_quantity", getattr(node, "unique_quantity", None))
+        return base
+
+    base["children"] = []
+    base["unique_item"] = False
     return base
 
 
 def _collect_item_ids(node: StockNode, collector: List[int]) -> None:
-    if node.type == NodeType.ITEM or getattr(node, "unique_item", False):
-        collector.append(int(node.id))
-        return
-    for child in getattr(node, "children", []) or []:
-        _collect_item_ids(child, collector)
+    collector.extend(_load_subtrees([int(node.id)])[2])
+
+
+def _status_counts(items: List[int], latest: Dict[int, Dict[str, Any]]) -> Dict[str, int]:
+    """Récapitulatif OK / NOT_OK / TODO (même résultat que tree_stats) sans re-parcourir l'arbre."""
+    ok = not_ok = 0
+    for nid in items:
+        status = latest.get(nid, {}).get("status", "TODO")
+        if status == "OK":
+            ok += 1
+        elif status == "NOT_OK":
+            not_ok += 1
+    total = len(items)
+    return {"total": total, "ok": ok, "not_ok": not_ok, "todo": total - ok - not_ok}
+
+
+# Requêtes attendues pour les arbres (CTE, dernières vérifs, péremptions),
+# lots d'IN découpés non comptés : au-delà, un lazy-load par nœud est revenu.
+_TREE_QUERY_BUDGET = 3
+
+
+def _build_trees(
+    roots: List[StockNode],
+    stats: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    if current_app.debug:
+        # dev : même garde-fou que tree_query (approximatif sous eventlet)
+        with count_queries(db.session.get_bind()) as queries:
+            trees = _build_trees_uncounted(roots, stats)
+        if queries[0] > _TREE_QUERY_BUDGET:
+            current_app.logger.warning(
+                "[PERIODIC TREE] roots=%s : %s requêtes (budget %s), N+1 ?",
+                [int(r.id) for r in roots], queries[0], _TREE_QUERY_BUDGET,
+            )
+        return trees
+    return _build_trees_uncounted(roots, stats)
 
 
-def _build_tree(root: StockNode) -> List[Dict[str, Any]]:
-    items: List[int] = []
-    _collect_item_ids(root, items)
+def _build_trees_uncounted(
+    roots: List[StockNode],
+    stats: Optional[Dict[str, int]],
+) -> List[Dict[str, Any]]:
+    # une CTE pour tous les sous-arbres, puis vérifs / péremptions en lot
+    root_rows, children_idx, items = _load_subtrees([int(r.id) for r in roots])
     latest = _latest_map(items)
     exp_map = _expiries_for_items(items)
-    return [_serialize(root, latest, exp_map)]
+    if stats is not None:
+        stats.update(_status_counts(items, latest))
+    # Construction itérative : un payload par ligne, puis rattachement de chaque
+    # liste d'enfants (déjà triée par (level, id)) à son parent, sans récursion
+    by_id: Dict[int, Dict[str, Any]] = {
+        rid: _node_payload(row, latest, exp_map) for rid, row in root_rows.items()
+    }
+    for kids in children_idx.values():
+        for child in kids:
+            by_id[child.id] = _node_payload(child, latest, exp_map)
+    for parent_id, kids in children_idx.items():
+        parent = by_id.get(parent_id)
+        if parent is not None:
+            parent["children"].extend([by_id[child.id] for child in kids])
+    return [by_id[int(r.id)] for r in roots if int(r.id) in by_id]
+
+
+# Cache (process) des arbres par racine. La version est propre à la racine :
+# nœuds du sous-arbre, vérifs et péremptions de ses items (une requête sur
+# _subtree_cte) ; une vérif sur une autre racine ne l'invalide pas.
+# Les écritures StockNode / StockItemExpiry de ce process vident le cache au
+# commit (une modif en place ne change pas la version) ; le TTL borne celles
+# faites ailleurs.
+# Entrée : [version, horodatage, arbre, stats, JSON de /tree (rempli à la demande)].
+_TREE_CACHE_TTL = 30.0
+_TREE_CACHE_MAX = 64
+_TREE_CACHE: Dict[int, List[Any]] = {}
+_TREE_MODELS: Tuple[type, ...] = (StockNode,) + ((StockItemExpiry,) if HAS_EXP_MODEL else ())
+_TREE_STALE = "periodic_tree_stale"   # drapeau dans session.info
+
+
+@event.listens_for(Session, "before_flush")
+def _mark_tree_writes(session: Session, flush_context: Any, instances: Any) -> None:
+    if any(isinstance(o, _TREE_MODELS) for o in chain(session.new, session.dirty, session.deleted)):
+        session.info[_TREE_STALE] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_tree_bulk_writes(state: Any) -> None:
+    # update()/delete()/insert() ORM en masse : ne passent pas par le flush
+    if state.is_update or state.is_delete or state.is_insert:
+        mapper = state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, _TREE_MODELS):
+            state.session.info[_TREE_STALE] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_tree_cache(session: Session) -> None:
+    if session.info.pop(_TREE_STALE, False):
+        _TREE_CACHE.clear()
+
+
+def _tree_version(root_id: int) -> Tuple[Any, ...]:
+    walk = _subtree_cte([root_id])
+    leaves = select(walk.c.id).where((walk.c.type == NodeType.ITEM) | walk.c.unique_item.is_(True))
+    pvr = PeriodicVerificationRecord
+    on_leaves = pvr.node_id.in_(leaves)
+    # sous-requêtes scalaires : une ligne, pas de produit cartésien entre tables dérivées
+    parts = [
+        select(func.count()).select_from(walk).scalar_subquery(),
+        select(func.max(walk.c.id)).scalar_subquery(),
+        select(func.count(pvr.id)).where(on_leaves).scalar_subquery(),
+        select(func.max(pvr.id)).where(on_leaves).scalar_subquery(),
+        select(func.max(pvr.updated_at)).where(on_leaves).scalar_subquery(),
+    ]
+    if HAS_EXP_MODEL:
+        exp = StockItemExpiry
+        exp_on_leaves = exp.node_id.in_(leaves)  # type: ignore[union-attr]
+        parts.append(select(func.count(exp.id)).where(exp_on_leaves).scalar_subquery())  # type: ignore[union-attr]
+        parts.append(select(func.max(exp.id)).where(exp_on_leaves).scalar_subquery())  # type: ignore[union-attr]
+    return tuple(db.session.execute(select(*parts)).one())
+
+
+def _tree_entry(root: StockNode) -> List[Any]:
+    version = _tree_version(int(root.id))
+    now = time.monotonic()
+    hit = _TREE_CACHE.get(int(root.id))
+    if hit and hit[0] == version and now - hit[1] <= _TREE_CACHE_TTL:
+        return hit
+
+    stats: Dict[str, int] = {}
+    tree = _build_trees([root], stats=stats)
+    if len(_TREE_CACHE) >= _TREE_CACHE_MAX:
+        _TREE_CACHE.clear()
+    entry = [version, now, tree, stats, None]
+    _TREE_CACHE[int(root.id)] = entry
+    return entry
+
+
+def _build_tree(
+    root: StockNode,
+    stats: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """Arbre de la racine (mémoïsé par version) : partagé, ne pas le modifier."""
+    entry = _tree_entry(root)
+    if stats is not None:
+        stats.update(entry[3])
+    return entry[2]
 
 
 def _build_forest(roots: List[StockNode]) -> List[Dict[str, Any]]:
-    forest: List[Dict[str, Any]] = []
-    for root in roots:
-        try:
-            tree = _build_tree(root)
-        except Exception:
-            db.session.rollback()
-            continue
-        if tree:
-            forest.extend(tree)
-    return forest
+    if not roots:
+        return []
+    try:
+        return _build_trees(roots)
+    except Exception:
+        db.session.rollback()
+        return []
 
 
 def _safe_int(value: Any) -> int | None:
@@ -340,24 +551,21 @@ def _reset_items_to_todo(
         return 0
 
     latest = _latest_map(item_ids)
-    updated = 0
-    for item_id in item_ids:
-        last_status = (latest.get(item_id, {}).get("status") or "TODO").upper()
-        if last_status == "TODO":
-            continue
-        rec = PeriodicVerificationRecord(
-            node_id=item_id,
-            status=ItemStatus.TODO,
-            verifier_id=actor_id,
-            verifier_name=actor_name,
-            comment=None,
-            issue_code=None,
-            observed_qty=None,
-            missing_qty=None,
-        )
-        db.session.add(rec)
-        updated += 1
-    return updated
+    rows = [
+        {
+            "node_id": item_id,
+            "status": ItemStatus.TODO,
+            "verifier_id": actor_id,
+            "verifier_name": actor_name,
+        }
+        for item_id in item_ids
+        if (latest.get(item_id, {}).get("status") or "TODO").upper() != "TODO"
+    ]
+    if rows:
+        # INSERT groupé (executemany) plutôt qu'un objet ORM + flush par item ;
+        # created_at / updated_at gardent leurs défauts de colonne
+        db.session.execute(insert(PeriodicVerificationRecord), rows)
+    return len(rows)
 
 
 def _share_payload(link: PeriodicVerificationLink) -> Dict[str, Any]:
@@ -449,21 +657,19 @@ def tree(root_id: int):
 
     _ensure_table()
 
-    node = db.session.get(StockNode, root_id)
+    node = _resolve_root(root_id)
     if not node:
         return jsonify(error="Parent introuvable"), 404
 
-    while node.parent_id is not None:
-        node = node.parent
-
-    tree_payload = _build_tree(node)
-    stats = tree_stats(tree_payload)
-
-    return jsonify({
-        "root": {"id": node.id, "name": node.name},
-        "tree": tree_payload,
-        "stats": stats,
-    })
+    # réponse encodée une fois par version de l'arbre, resservie telle quelle
+    entry = _tree_entry(node)
+    if entry[4] is None:
+        entry[4] = dumps({
+            "root": {"id": node.id, "name": node.name},
+            "tree": entry[2],
+            "stats": entry[3],
+        })
+    return json_bytes_response(entry[4])
 
 
 @bp.get("/public")
@@ -601,6 +807,10 @@ def public_catalog_submit():
     )
 
 
+_HISTORY_PAGE = 50
+_HISTORY_PAGE_MAX = 200
+
+
 @bp.get("/history/<int:root_id>")
 @login_required
 def history(root_id: int):
@@ -613,12 +823,29 @@ def history(root_id: int):
     if not root:
         return jsonify(error="Parent introuvable"), 404
 
-    sessions = (
-        PeriodicVerificationSession.query
-        .filter_by(root_id=root.id)
-        .order_by(PeriodicVerificationSession.created_at.desc())
-        .limit(50)
-        .all()
+    # Pagination côté serveur (?limit=&offset=, 50 par défaut, 200 max)
+    limit = min(max(_safe_int(request.args.get("limit")) or _HISTORY_PAGE, 1), _HISTORY_PAGE_MAX)
+    offset = max(_safe_int(request.args.get("offset")) or 0, 0)
+
+    # Colonnes lues + nom du vérificateur par jointure : pas de lazy-load de
+    # session.verifier par ligne
+    pvs = PeriodicVerificationSession
+    sessions = db.session.execute(
+        select(
+            pvs.id,
+            pvs.created_at,
+            pvs.verifier_name,
+            pvs.verifier_first_name,
+            pvs.verifier_last_name,
+            pvs.source,
+            pvs.comment,
+            User.username,
+        )
+        .outerjoin(User, User.id == pvs.verifier_id)
+        .where(pvs.root_id == root.id)
+        .order_by(pvs.created_at.desc(), pvs.id.desc())
+        .limit(limit)
+        .offset(offset)
     )
 
     payload: List[Dict[str, Any]] = []
@@ -627,7 +854,7 @@ def history(root_id: int):
         display_name = (
             session.verifier_name
             or (f"{(session.verifier_first_name or '').strip()} {(session.verifier_last_name or '').strip()}".strip())
-            or getattr(getattr(session, "verifier", None), "username", None)
+            or session.username
             or None
         )
         if display_name:
@@ -645,7 +872,12 @@ def history(root_id: int):
             }
         )
 
-    return jsonify({"root": {"id": root.id, "name": root.name}, "records": payload})
+    return json_response({
+        "root": {"id": root.id, "name": root.name},
+        "records": payload,
+        "limit": limit,
+        "offset": offset,
+    })
 
 
 @bp.post("/verify")
@@ -1051,24 +1283,25 @@ def reassort_options(node_id: int):
 
     _ensure_reassort_tables()
 
+    # Article chargé par la jointure (contains_eager, pas de SELECT par lot) et
+    # tri fait en SQL : article du nœud d'abord, puis nom, péremption, id
     batches = (
         ReassortBatch.query
         .join(ReassortItem)
+        .options(contains_eager(ReassortBatch.item))
         .filter(ReassortBatch.quantity > 0)
         .filter(or_(ReassortItem.target_node_id == node_id, ReassortItem.target_node_id.is_(None)))
-        .all()
-    )
-    batches.sort(
-        key=lambda b: (
-            b.item.target_node_id != node_id if b.item else True,
-            (b.item.name.lower() if b.item and b.item.name else ""),
-            b.expiry_date or date.max,
-            b.id,
+        .order_by(
+            case((ReassortItem.target_node_id == node_id, 0), else_=1),
+            func.lower(ReassortItem.name),
+            ReassortBatch.expiry_date.asc().nullslast(),
+            ReassortBatch.id.asc(),
         )
+        .all()
     )
 
     payload = [_serialize_reassort_batch(b, node_id) for b in batches]
-    return jsonify({"node_id": node_id, "items": payload})
+    return json_response({"node_id": node_id, "items": payload})
 
 
 @bp.post("/replace")
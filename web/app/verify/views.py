@@ -18,8 +18,11 @@ from ..models import (
     ReassortBatch,
     ReassortItem,
 )
-from ..tree_query import build_event_tree
-from sqlalchemy import or_
+from ..tree_query import build_event_tree, build_event_tree_json
+from ..jsonutil import json_bytes_response, json_response
+from ..schema_compat import ensure_tables
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import contains_eager
 from datetime import date, datetime
 
 bp = Blueprint("verify", __name__)
@@ -38,19 +41,13 @@ def _sanitize_tree(node: Dict[str, Any]) -> Dict[str, Any]:
     return node
 
 
+# DDL fait au démarrage (schema_compat) : plus qu'une vérification par process
 def _ensure_reassort_tables() -> None:
-    try:
-        ReassortItem.__table__.create(bind=db.engine, checkfirst=True)
-        ReassortBatch.__table__.create(bind=db.engine, checkfirst=True)
-    except Exception:
-        db.session.rollback()
+    ensure_tables(ReassortItem, ReassortBatch)
 
 
 def _ensure_expiry_table() -> None:
-    try:
-        StockItemExpiry.__table__.create(bind=db.engine, checkfirst=True)
-    except Exception:
-        db.session.rollback()
+    ensure_tables(StockItemExpiry)
 
 # --------- pages publiques ---------
 @bp.get("/public/event/<token>")
@@ -74,9 +71,8 @@ def public_event_tree(token: str):
     if not link or not link.event:
         abort(404)
     ev = link.event
-    tree: List[dict] = build_event_tree(ev.id) or []
-    tree = [_sanitize_tree(n) for n in tree]
-    return jsonify(tree)
+    # _sanitize_tree est l'identité : JSON mis en cache servi tel quel
+    return json_bytes_response(build_event_tree_json(ev.id))
 
 # --------- vérif publique (ITEM) ---------
 @bp.post("/public/event/<token>/verify")
@@ -306,22 +302,25 @@ def public_reassort_options(token: str, node_id: int):
 
     _ensure_reassort_tables()
 
+    # Même requête que la vérification périodique : article via la jointure,
+    # tri en SQL
     batches = (
         ReassortBatch.query
         .join(ReassortItem)
+        .options(contains_eager(ReassortBatch.item))
         .filter(ReassortBatch.quantity > 0)
         .filter(or_(ReassortItem.target_node_id == node_id, ReassortItem.target_node_id.is_(None)))
+        .order_by(
+            case((ReassortItem.target_node_id == node_id, 0), else_=1),
+            func.lower(ReassortItem.name),
+            ReassortBatch.expiry_date.asc().nullslast(),
+            ReassortBatch.id.asc(),
+        )
         .all()
     )
-    batches.sort(key=lambda b: (
-        b.item.target_node_id != node_id if b.item else True,
-        (b.item.name.lower() if b.item and b.item.name else ""),
-        b.expiry_date or date.max,
-        b.id,
-    ))
 
     payload = [_serialize_reassort_batch(b, node_id) for b in batches]
-    return jsonify({
+    return json_response({
         "node_id": node_id,
         "items": payload,
     })